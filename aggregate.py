@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class QuantileSketch():
+    """
+    Streaming quantile sketch per timestep (DDSketch). Values are
+    counted in logarithmic buckets, so any quantile is known within
+    relative_accuracy of the true value while the memory only depends
+    on the number of timesteps and the value range, not on the number
+    of paths. Values outside [min_value, max_value] are counted in the
+    first / last bucket.
+    """
+    def __init__(self, num_timesteps: int, relative_accuracy: float = 0.01, min_value: float = 1e-2, max_value: float = 1e12):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.offset = int(np.floor(np.log(min_value) / self.log_gamma))
+        self.num_bins = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset + 1
+        self.counts = np.zeros((num_timesteps, self.num_bins), dtype=np.int32)
+        self.steps = np.arange(num_timesteps) * self.num_bins
+
+    def Add(self, paths):
+        """
+        Adds a batch of paths, shape (num_paths, num_timesteps)
+        """
+        # A thousand paths at a time keeps the temporary arrays small
+        for first in range(0, len(paths), 1024):
+            chunk = paths[first:first + 1024]
+            bins = np.ceil(np.log(np.maximum(chunk, self.min_value)) / self.log_gamma).astype(np.int64) - self.offset
+            np.clip(bins, 0, self.num_bins - 1, out=bins)
+            bins += self.steps
+            self.counts += np.bincount(bins.ravel(), minlength=self.counts.size).reshape(self.counts.shape).astype(np.int32)
+
+    def Quantile(self, q: float):
+        """
+        Approximate q-quantile (0 <= q <= 1) of every timestep
+        """
+        cumulative = self.counts.cumsum(axis=1)
+        rank = q * (cumulative[:, -1] - 1)
+        bins = (cumulative > rank[:, None]).argmax(axis=1)
+        return 2 * self.gamma ** (bins + self.offset) / (self.gamma + 1)
+
+
+class PathAggregate():
+    """
+    Per-timestep statistics of simulated paths that are updated
+    batch by batch: count, mean, minimum, maximum and approximate
+    percentiles. Memory stays bounded however many paths are added.
+    """
+    def __init__(self, num_timesteps: int, percentiles=(5, 50, 95), relative_accuracy: float = 0.01):
+        self.num_timesteps = num_timesteps
+        self.percentiles = tuple(percentiles)
+        self.count = 0
+        self.sum = np.zeros(num_timesteps)
+        self.min = np.full(num_timesteps, np.inf)
+        self.max = np.full(num_timesteps, -np.inf)
+        self.sketch = QuantileSketch(num_timesteps, relative_accuracy)
+
+    def Add(self, paths):
+        """
+        Adds a batch of paths, shape (num_paths, num_timesteps)
+        """
+        paths = np.asarray(paths, dtype=float)
+        self.count += len(paths)
+        self.sum += paths.sum(axis=0)
+        np.minimum(self.min, paths.min(axis=0), out=self.min)
+        np.maximum(self.max, paths.max(axis=0), out=self.max)
+        self.sketch.Add(paths)
+
+    def Mean(self):
+        return self.sum / self.count
+
+    def Percentile(self, percentile: float):
+        """
+        Approximate percentile (0-100) of every timestep
+        """
+        return np.clip(self.sketch.Quantile(percentile / 100), self.min, self.max)
+
+    def Percentiles(self):
+        """
+        Dictionary percentile -> values per timestep for the
+        configured percentiles
+        """
+        return {percentile: self.Percentile(percentile) for percentile in self.percentiles}
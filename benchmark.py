@@ -0,0 +1,208 @@
+"""
+Offline benchmark suite. Runs the expensive Model methods against a
+SyntheticMarket (no network access) at several portfolio sizes,
+history lengths and simulation counts and writes the timings as JSON,
+so two versions can be compared.
+
+    python benchmark.py [--quick] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+from cache import HistoryCache
+from model import Model
+from prices import PriceSnapshot
+from registry import ModelRegistry
+from startup import MeasureStartup
+from synthetic import SyntheticMarket
+
+FOREST = {'n_estimators': 10} # Small forests keep the training cases short
+
+SUITES = {
+    'full': {
+        'history': ['1y', '5y', '10y'],
+        'train_assets': [1, 4],
+        'simulations': [10, 100, 1000],
+        'simulate_assets': [1, 4],
+        'portfolio': [10, 100, 1000],
+        'repeats': 3,
+    },
+    'quick': {
+        'history': ['1y', '10y'],
+        'train_assets': [1],
+        'simulations': [10, 100],
+        'simulate_assets': [1],
+        'portfolio': [10, 100],
+        'repeats': 2,
+    },
+}
+
+
+class Benchmark():
+    """
+    Collects the timings of the benchmark cases
+    """
+    def __init__(self, directory: str, repeats: int = 3):
+        self.directory = directory
+        self.repeats = repeats
+        self.market = SyntheticMarket()
+        self.results = []
+
+    def NewModel(self, num_assets: int = 0, registry: str = 'models'):
+        """
+        Model on the synthetic market with num_assets assets
+        """
+        model = Model(cache=HistoryCache(os.path.join(self.directory, 'history.sqlite'), fetch=self.market.History),
+                      prices=PriceSnapshot(fetch=self.market.Quotes),
+                      registry=ModelRegistry(os.path.join(self.directory, registry)))
+        for i in range(num_assets):
+            ticker = f"SYN{i}"
+            info = self.market.Info(ticker)
+            model.AddTicker(ticker, info['sector'], info['typeDisp'], 10 + i, info['currentPrice'])
+        return model
+
+    def Time(self, name: str, params: dict, function, setup=None):
+        """
+        Runs function `repeats` times (after setup, which is not timed)
+        and records the durations
+        """
+        durations = []
+        for _ in range(self.repeats):
+            argument = setup() if setup is not None else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                function(argument) if setup is not None else function()
+                durations.append(time.perf_counter() - start)
+        return self.Record(name, params, durations)
+
+    def Record(self, name: str, params: dict, durations: list):
+        result = {'name': name, 'params': params, 'repeats': len(durations),
+                  'seconds': {'min': min(durations), 'median': statistics.median(durations), 'max': max(durations)}}
+        self.results.append(result)
+        print(f"{name:<14} {json.dumps(params):<70} median {result['seconds']['median']:.4f}s")
+        return result
+
+    def Run(self, suite: dict):
+        self.Record('startup', {}, MeasureStartup(self.repeats))
+
+        model = self.NewModel()
+        for length in suite['history']:
+            data = model.GetHistoricalData('SYN0', length)
+            features = model.GetAssetFeatures(data)
+            self.Time('features', {'history': length, 'rows': len(data)}, lambda: model.GetAssetFeatures(data))
+            self.Time('transform', {'history': length, 'rows': len(features), 'look_back': 60},
+                      lambda: model.TransformData(features, 60))
+
+        for num_assets in suite['train_assets']:
+            model = self.NewModel(num_assets)
+            model.GetHistories([asset.name for asset in model.GetAssets()], '10y') # Fill the cache, only training is timed
+            counter = iter(range(10 ** 6))
+            self.Time('train', {'assets': num_assets, 'look_back': 60, **FOREST},
+                      lambda fresh: fresh.TrainModels(60, params=FOREST),
+                      setup=lambda: self.NewModel(num_assets, f"models-{next(counter)}"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.TrainModels(60, params=FOREST) # Fills the registry
+            self.Time('train_reuse', {'assets': num_assets, 'look_back': 60, **FOREST},
+                      lambda: model.TrainModels(60, params=FOREST))
+
+        for num_assets in suite['simulate_assets']:
+            model = self.NewModel(num_assets)
+            with contextlib.redirect_stdout(io.StringIO()):
+                models = model.TrainModels(60, params=FOREST)
+            for num_simulations in suite['simulations']:
+                self.Time('simulate', {'assets': num_assets, 'simulations': num_simulations, 'years': 1, 'look_back': 60},
+                          lambda: model.SimulateBatch(num_simulations, 1, 60, models=models))
+            self.CheckShards(model, models)
+
+        for num_assets in suite['portfolio']:
+            model = self.NewModel(num_assets)
+            self.Time('calculations', {'assets': num_assets}, lambda: model.GetCalculations('total'))
+            self.Time('breakdown', {'assets': num_assets}, lambda: model.GetBreakdown('sector'))
+
+
+    def CheckShards(self, model, models, num_simulations: int = 40, shard_size: int = 10, seed: int = 0):
+        """
+        Simulates the same seeded shards on 1 and on 3 worker processes
+        and records both timings. The paths must be identical, they only
+        depend on the seed and the shard size
+        """
+        import numpy as np
+
+        paths = dict()
+        for workers in (1, 3):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                paths[workers] = np.concatenate(list(model.SimulateStream(num_simulations, 1, 60, shard_size, models,
+                                                                          workers=workers, seed=seed)))
+                duration = time.perf_counter() - start
+            self.Record('simulate_shards', {'assets': len(models), 'simulations': num_simulations, 'workers': workers}, [duration])
+        if not np.array_equal(paths[1], paths[3]):
+            raise RuntimeError("Sharded simulation differs between 1 and 3 workers")
+
+
+def Metadata():
+    """
+    Describes the environment the benchmark ran in
+    """
+    import numpy
+    import pandas
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def Compare(results: list, baseline: list):
+    """
+    Prints the median time of every case relative to the baseline
+    """
+    previous = {(result['name'], json.dumps(result['params'], sort_keys=True)): result for result in baseline}
+    print(f"\n{'case':<14} {'params':<70} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for result in results:
+        key = (result['name'], json.dumps(result['params'], sort_keys=True))
+        if key in previous:
+            before = previous[key]['seconds']['median']
+            now = result['seconds']['median']
+            print(f"{result['name']:<14} {json.dumps(result['params']):<70} {before:>10.4f} {now:>10.4f} {now / before:>7.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes, fewer repeats")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file for the results")
+    parser.add_argument('--compare', help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    suite = SUITES['quick' if args.quick else 'full']
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark = Benchmark(directory, suite['repeats'])
+        benchmark.Run(suite)
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': Metadata(), 'suite': suite, 'results': benchmark.results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            Compare(benchmark.results, json.load(f)['results'])
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from profiler import Profiler
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'history.sqlite')
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+PERIOD_UNITS = {'d': 'days', 'wk': 'weeks', 'mo': 'months', 'y': 'years'}
+
+
+def PeriodStart(period: str):
+    """
+    Translates a yfinance period ('5d', '1mo', '2y', 'ytd', 'max')
+    into the first date it covers as 'YYYY-MM-DD'.
+    Returns None for 'max'
+    """
+    import pandas as pd
+
+    today = pd.Timestamp.today().normalize()
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return today.replace(month=1, day=1).strftime('%Y-%m-%d')
+    for unit, name in PERIOD_UNITS.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            start = today - pd.DateOffset(**{name: int(period[:-len(unit)])})
+            return start.strftime('%Y-%m-%d')
+    raise ValueError(f"Unknown period {period}")
+
+
+def FetchHistory(ticker: str, interval: str = '1d', period: str = None, start: str = None, timeout: float = 10):
+    """
+    Downloads OHLCV bars from Yahoo Finance, either for a period
+    or from a start date up to today. Gives up on a request after
+    timeout seconds
+    """
+    import yfinance as yf
+    if start is not None:
+        return yf.Ticker(ticker).history(start=start, interval=interval, timeout=timeout)
+    return yf.Ticker(ticker).history(period=period, interval=interval, timeout=timeout)
+
+
+def BarDates(data):
+    """
+    The dates of the bars in data as stored ('YYYY-MM-DD HH:MM:SS',
+    exchange time) and the time zone of the exchange (None if unknown)
+    """
+    import pandas as pd
+
+    index = pd.DatetimeIndex(data.index)
+    timezone = None
+    if index.tz is not None:
+        timezone = str(index.tz)
+        index = index.tz_localize(None)
+    return index.strftime('%Y-%m-%d %H:%M:%S'), timezone
+
+
+class HistoryCache():
+    """
+    On-disk (SQLite) cache of historical price bars, keyed by ticker
+    and interval. Bars older than ttl seconds are refreshed by only
+    fetching the days after the last stored bar (all of them again after
+    a split or dividend, see Refresh). In offline mode the
+    cache never goes to the network and only serves what it has.
+    fetch can be replaced by any function with the signature of
+    FetchHistory, e.g. to run against local fixture data.
+    """
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = 3600, offline: bool = False, fetch=FetchHistory):
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self.fetch = fetch
+        self.profiler = Profiler() # Replaced by the profiler of the Model using the cache
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self.Connect()) as connection, connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS bars (
+                ticker TEXT, interval TEXT, date TEXT,
+                open REAL, high REAL, low REAL, close REAL, volume REAL, dividends REAL, splits REAL,
+                PRIMARY KEY (ticker, interval, date))""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS series (
+                ticker TEXT, interval TEXT, covered_from TEXT, fetched_at REAL, timezone TEXT,
+                PRIMARY KEY (ticker, interval))""")
+
+    def Connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def Series(self, ticker: str, interval: str = '1d'):
+        """
+        Returns (covered_from, fetched_at, timezone) of a cached
+        series, None if the ticker was never stored
+        """
+        with closing(self.Connect()) as connection:
+            return connection.execute(
+                "SELECT covered_from, fetched_at, timezone FROM series WHERE ticker = ? AND interval = ?",
+                (ticker, interval)).fetchone()
+
+    def Get(self, ticker: str, period: str = '1y', interval: str = '1d'):
+        """
+        Returns the bars of the given period as a pd.DataFrame (like
+        yf.Ticker.history). Fetches the whole period when the cache does
+        not reach back far enough, and only the missing trailing days
+        when the cached bars are older than the TTL.
+        Returns None if nothing is cached in offline mode
+        """
+        start = PeriodStart(period)
+        series = self.Series(ticker, interval)
+        if not self.offline:
+            covered_from = '' if start is None else start
+            try:
+                if series is None or series[0] > covered_from:
+                    self.profiler.Count('network_calls')
+                    self.Store(ticker, interval, self.fetch(ticker, interval=interval, period=period), covered_from)
+                elif time.time() - series[1] > self.ttl:
+                    self.Refresh(ticker, interval)
+                else:
+                    self.profiler.Count('cache_hits')
+            except Exception:
+                if series is None:
+                    raise
+                # Serve the cached bars if Yahoo can not be reached
+            series = self.Series(ticker, interval)
+        elif series is not None:
+            self.profiler.Count('cache_hits')
+        if series is None:
+            return None
+        return self.Load(ticker, interval, start, series[2])
+
+    def Refresh(self, ticker: str, interval: str = '1d'):
+        """
+        Fetches the bars from the second last stored day onwards, the
+        last bar is replaced as it may have been incomplete.
+        Yahoo adjusts the whole history for splits and dividends, so
+        when there is one in the new bars, or the close of the second
+        last (complete) bar changed, the stored bars are on an old basis:
+        then the whole covered period is fetched again and replaces them
+        """
+        with closing(self.Connect()) as connection:
+            recent = connection.execute(
+                "SELECT date, close FROM bars WHERE ticker = ? AND interval = ? ORDER BY date DESC LIMIT 2",
+                (ticker, interval)).fetchall()
+        self.profiler.Count('network_calls')
+        if len(recent) == 0:
+            self.Store(ticker, interval, self.fetch(ticker, interval=interval, period='max'))
+            return
+        date, close = recent[-1]
+        data = self.fetch(ticker, interval=interval, start=date[:10])
+        if self.Adjusted(data, recent[0][0], date, close if len(recent) == 2 else None):
+            self.Reload(ticker, interval)
+        else:
+            self.Store(ticker, interval, data)
+
+    def Adjusted(self, data, last: str, date: str, close: float = None):
+        """
+        True if the bars in data hold a split or dividend after the last
+        stored bar, or if their bar at date no longer has the stored close
+        """
+        import numpy as np
+
+        if data is None or len(data) == 0:
+            return False
+        data = data.reindex(columns=COLUMNS, fill_value=0.0)
+        dates = np.asarray(BarDates(data)[0])
+        new = dates > last
+        if (data['Dividends'].to_numpy()[new] != 0).any() or (data['Stock Splits'].to_numpy()[new] != 0).any():
+            return True
+        overlap = data['Close'].to_numpy(dtype=float)[dates == date]
+        return close is not None and len(overlap) > 0 and not np.isclose(overlap[0], close, rtol=1e-5)
+
+    def Reload(self, ticker: str, interval: str = '1d'):
+        """
+        Fetches the whole covered period of a series again and
+        replaces all of its stored bars
+        """
+        covered_from = self.Series(ticker, interval)[0]
+        self.profiler.Count('network_calls')
+        self.profiler.Count('history_reloads')
+        if covered_from:
+            data = self.fetch(ticker, interval=interval, start=covered_from)
+        else:
+            data = self.fetch(ticker, interval=interval, period='max')
+        self.Store(ticker, interval, data, replace=True)
+
+    def Store(self, ticker: str, interval: str, data, covered_from: str = None, replace: bool = False):
+        """
+        Inserts (or replaces) the bars in data and marks the series
+        as fetched now. covered_from is the first date the stored bars
+        are complete from. With replace the stored bars of the series
+        are deleted first (in the same transaction).
+        """
+        timezone = None
+        rows = []
+        if data is not None and len(data) > 0:
+            data = data.reindex(columns=COLUMNS, fill_value=0.0)
+            dates, timezone = BarDates(data)
+            rows = [(ticker, interval, date, *values) for date, values in zip(dates, data.to_numpy(dtype=float).tolist())]
+        with closing(self.Connect()) as connection, connection:
+            if replace and len(rows) > 0:
+                connection.execute("DELETE FROM bars WHERE ticker = ? AND interval = ?", (ticker, interval))
+            connection.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("""INSERT INTO series VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (ticker, interval) DO UPDATE SET
+                covered_from = COALESCE(excluded.covered_from, covered_from),
+                fetched_at = excluded.fetched_at,
+                timezone = COALESCE(excluded.timezone, timezone)""",
+                (ticker, interval, covered_from, time.time(), timezone))
+
+    def Load(self, ticker: str, interval: str = '1d', start: str = None, timezone: str = None):
+        """
+        Reads the cached bars from start (inclusive) onwards
+        """
+        import pandas as pd
+
+        with closing(self.Connect()) as connection:
+            data = pd.read_sql_query(
+                "SELECT date, open, high, low, close, volume, dividends, splits FROM bars "
+                "WHERE ticker = ? AND interval = ? AND date >= ? ORDER BY date",
+                connection, params=(ticker, interval, '' if start is None else start))
+        index = pd.DatetimeIndex(pd.to_datetime(data.pop('date')), name='Date')
+        if timezone is not None:
+            index = index.tz_localize(timezone)
+        data.columns = COLUMNS
+        data.index = index
+        return data
@@ -1,12 +1,19 @@
+import argparse
+import os
 import time
 
+from cache import HistoryCache
 from model import Model
+from profiler import Profiler
 from view import View
 
 
 class Controller():
-    def __init__(self):
-        self.Model = Model()
+    def __init__(self, offline: bool = False, profile: bool = False, profile_dir: str = 'profiles', profile_format: str = 'json', plot_dir: str = None):
+        self.Model = Model(cache=HistoryCache(offline=offline), profiler=Profiler(enabled=profile))
+        self.profile_dir = profile_dir
+        self.profile_format = profile_format
+        self.plot_dir = plot_dir
 
     def GetStarted(self):
         """
@@ -18,7 +25,7 @@ class Controller():
 
         print("Welcome to the portfolio tracker. What do you want to do today?")
         option = ''
-        valid_options = {'A', 'S', 'V', 'C', 'P'}
+        valid_options = {'A', 'S', 'V', 'C', 'P', 'R'}
         while (option.capitalize() not in valid_options):
             print("\n\
               (A) add assets to your portfolio\n\
@@ -26,6 +33,7 @@ class Controller():
               (V) View your current portfolio\n\
               (C) Show calculations and weights of your portfolio\n\
               (P) Perform a simulation\n\
+              (R) Show the risk of your portfolio\n\
               (E) Exit the application\n")
             option = input("Please, enter your option (letter):\n")
             match option.capitalize():
@@ -44,14 +52,49 @@ class Controller():
                 case 'P':
                     print('You chose to perform a simulation.\n')
                     self.PerformSimulation()
+                case 'R':
+                    print('You chose to show the risk of your portfolio.\n')
+                    self.ShowRisk()
                 case 'E':
                     break
                 case _:
-                    print('That is not a valid option. Enter A, S, V, C or P or E (Exit).\n')
+                    print('That is not a valid option. Enter A, S, V, C, P or R or E (Exit).\n')
+            if option.capitalize() in valid_options:
+                self.ExportProfile(option.capitalize())
             option = ''
             time.sleep(1)
 
 
+    def ExportProfile(self, action: str):
+        """
+        When profiling is enabled, writes the phase timings and counters
+        of the last menu action to the profile directory (JSON or CSV)
+        and starts a new profile for the next action.
+        """
+        profiler = self.Model.profiler
+        if not profiler.enabled:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{action}.{self.profile_format}")
+        profiler.Export(path)
+        print(f"Profile written to {path}")
+        profiler.Reset()
+
+
+    def NewView(self, name: str, title: str, xlabel: str, ylabel: str):
+        """
+        Creates a View. With a plot directory the plot is written to
+        a PNG file there instead of shown (no display needed).
+        Long series are downsampled to 2000 points.
+        """
+        path = None
+        if self.plot_dir is not None:
+            os.makedirs(self.plot_dir, exist_ok=True)
+            path = os.path.join(self.plot_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.png")
+            print(f"Plot written to {path}")
+        return View(title, xlabel, ylabel, max_points=2000, path=path)
+
+
     def NewAsset(self):
         """
         This function adds a ticker to the model. Validates if the ticker exists (yhfinance)
@@ -106,23 +149,31 @@ class Controller():
         choice = input("")
         if choice.capitalize() == 'B':
             print("Please, enter the ticker name(s) you want to show. Enter 'C' to continue.")
-            tickers = set()
+            entered = []
             ticker_str = ''
             while ticker_str.capitalize() != 'C':
-                ticker_str = input("Enter a valid ticker, or typ 'C' to continue:\n")
+                ticker_str = input("Enter a ticker, or typ 'C' to continue:\n")
                 if ticker_str != 'C':
-                    if self.Model.VerifyTicker(ticker_str) is not None:
-                        tickers.add(ticker_str)
-                        print(f"Added {ticker_str} to the infograph")
-                    else:
-                        print("That is not a valid name. Please enter a valid ticker")
+                    entered.append(ticker_str)
+            tickers = set() # All entered tickers are validated at once
+            for ticker_str, ticker in self.Model.VerifyTickers(entered).items():
+                if ticker is not None:
+                    tickers.add(ticker_str)
+                    print(f"Added {ticker_str} to the infograph")
+                else:
+                    print(f"{ticker_str} is not a valid name, it is left out")
         else:
             tickers = {asset.name for asset in self.Model.GetAssets()}
         print(tickers)
         if tickers is not None:
-            plot = View("Historical price data", "Date", "Price") # Create view object
+            plot = self.NewView('prices', "Historical price data", "Date", "Price") # Create view object
+            self.Model.prices.GetPrices(tickers) # One bulk request for all quotes
+            histories = self.Model.GetHistories(tickers) # Fetched concurrently
             for ticker_str in tickers:
-                data = self.Model.GetHistoricalData(ticker_str)
+                data = histories[ticker_str]
+                if data is None or len(data) == 0:
+                    print(f"Could not retrieve the history of {ticker_str}, it is left out")
+                    continue
                 price = self.Model.GetPrice(ticker_str)
                 plot.PlotCurrentPrice(data.index, price, ticker_str)
                 if len(tickers) > 1:
@@ -130,6 +181,13 @@ class Controller():
                 else:
                     plot.PlotSingleHistory(data.index, data, ticker_str)
             plot.Show()
+            if choice.capitalize() != 'B' and len(tickers) > 0:
+                history = self.Model.GetValueHistory('1y', by='class') # Current holdings valued over the past year
+                plot = self.NewView('portfolio', "Historical value of the portfolio", "Date", "Value")
+                plot.PlotData(history.index, history.sum(axis=1), 'Portfolio')
+                for asset_class in history.columns:
+                    plot.PlotData(history.index, history[asset_class], asset_class)
+                plot.Show()
         else:
             print("It seems like you didn't add any valid ticker. Please try again.")
 
@@ -141,9 +199,11 @@ class Controller():
         print("________________________________________________________________________________________________")
         print(f"{'Ticker':<8} | {'Sector':<10} | {'Class':<7} | {'Quantity':>8} | {'Purchase Price':>14} | {'Transaction Value':>17} | {'Current value':>13}")
         print("_________|____________|_________|__________|________________|___________________|_______________")
-        for asset in self.Model.GetAssets():
+        assets = list(self.Model.GetAssets())
+        prices = self.Model.GetPrices(assets)
+        for asset, price in zip(assets, prices):
             transaction_value = asset.quantity * asset.purchase_price
-            current_value = asset.quantity * asset.GetPrice()
+            current_value = asset.quantity * price
             print(f"{asset.name:<8} | {asset.sector:<10} | {asset.asset_class:<7} | {asset.quantity:>8} | {asset.purchase_price:>14.2f} | {transaction_value:>17.2f} | {current_value:>13.2f}")
         print("_________|____________|_________|__________|________________|___________________|_______________")
 
@@ -167,14 +227,16 @@ class Controller():
                     print(f"Your portfolio is worth {round(total_value,3)} and is constructed as follows:")
                 case 'B':
                     print("Available classes:")
-                    print({asset.asset_class for asset in self.Model.GetAssets()})
+                    for item in self.Model.GetBreakdown('class'):
+                        print(item)
                     asset_class = input("Please enter the asset class you're interested in:\n")
                     calculations = self.Model.GetCalculations('class', asset_class=asset_class)
                     total_value = self.Model.GetPortfolioValue(option='class', label=asset_class)
                     print(f"Your portfolio over class {asset_class} is worth {round(total_value,3)} and is constructed as follows:")
                 case 'C':
                     print("Available sectors:")
-                    print({asset.sector for asset in self.Model.GetAssets()})
+                    for item in self.Model.GetBreakdown('sector'):
+                        print(item)
                     sector = input("Please enter the sector you're interested in:\n")
                     calculations = self.Model.GetCalculations('sector', sector=sector)
                     total_value = self.Model.GetPortfolioValue(option='sector', label=sector)
@@ -189,20 +251,68 @@ class Controller():
         """
         Performs a simulation with the current portfolio for upcoming 15 years
         Should perform 100.000 simulations paths
-        However, due to time limitations only 10 performed (edit this manually)
-        """
-        num_simulations = 10
-        paths = self.Model.SimulatePortfolio(num_simulations, 15, 60)
-        plot = View("Portfolio simulation using Random Forest Regressor (15y)", "Years ahead", "Estimated value", legend=False)
-        for idx,path in enumerate(paths):
-            my_list = [float(i) for i in path[1:]]
-            ind = [i/251 for i in range(len(path[1:]))]
-            plot.PlotData(ind, my_list, f'Scenario {idx}')
+        Paths are simulated in batches and only their statistics are kept,
+        the plot shows the mean and the 5-95 and 50 percentiles (edit num_simulations manually)
+        The random forests are slow, the parametric and bootstrap engines
+        simulate 100.000 paths of correlated returns
+        """
+        print("Which engine do you want to simulate with:\n\
+             (A) Random Forest Regressor (1000 paths)\n\
+             (B) correlated normal returns (100000 paths)\n\
+             (C) block bootstrap of historical returns (100000 paths)\n")
+        engines = {'A': ('rf', 1000, "Random Forest Regressor"),
+                   'B': ('parametric', 100000, "correlated normal returns"),
+                   'C': ('bootstrap', 100000, "block bootstrap")}
+        option = ''
+        while option not in engines:
+            option = input("Please enter your choice (A/B/C):\n").capitalize()
+        engine, num_simulations, name = engines[option]
+        if engine == 'rf': # The forests are simulated on all cores
+            aggregate = self.Model.SimulateAggregate(num_simulations, 15, 60, batch_size=100, engine=engine, workers=os.cpu_count())
+        else:
+            aggregate = self.Model.SimulateAggregate(num_simulations, 15, 60, batch_size=2000, engine=engine)
+        percentiles = aggregate.Percentiles()
+        years = [i/252 for i in range(aggregate.num_timesteps - 1)]
+        plot = self.NewView('simulation', f"Portfolio simulation using {name} (15y, {aggregate.count} paths)", "Years ahead", "Estimated value")
+        plot.PlotFan(years, percentiles[5][1:], percentiles[95][1:], 'P5 - P95')
+        plot.PlotData(years, percentiles[50][1:], 'Median (P50)')
+        plot.PlotData(years, aggregate.Mean()[1:], 'Mean')
         plot.Show()
 
 
+    def ShowRisk(self):
+        """
+        Prints the risk of the portfolio: volatility, Sharpe ratio and
+        the contribution of every asset over the last 10 years, and the
+        value at risk and drawdowns of 10.000 simulated paths
+        (correlated normal returns) over the next 15 years
+        """
+        risk = self.Model.GetRisk(10000, 15)
+        if risk is None:
+            print("There are no assets with a price history in your portfolio, add assets first.")
+            return
+        history, simulation = risk['history'], risk['simulation']
+        print(f"Past 10 years: return {history['return']:.2%} per year, volatility {history['volatility']:.2%}, Sharpe ratio {history['sharpe']:.2f}")
+        print("Contribution to the risk of the portfolio:")
+        for ticker, contribution in sorted(history['contribution'].items(), key=lambda item: -item[1]):
+            print(f"{ticker:<8} {contribution:>8.2%}")
+        print(f"Simulation ({simulation['paths']} paths): volatility {simulation['volatility']:.2%}, Sharpe ratio {simulation['sharpe']:.2f}")
+        for years, (var, cvar) in simulation['var'].items():
+            print(f"{years:>2} year(s): 95% VaR {var:.2%}, CVaR {cvar:.2%}")
+        drawdown = simulation['max_drawdown']
+        print(f"Maximum drawdown: median {drawdown[50]:.2%} (5%: {drawdown[5]:.2%}, 95%: {drawdown[95]:.2%})")
+
+
 
     
 if __name__ == '__main__':
-    control = Controller()
-    control.GetStarted()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Portfolio tracker")
+    parser.add_argument('--offline', action='store_true', help="only use locally cached price history")
+    parser.add_argument('--profile', action='store_true', help="write phase timings and counters of every action")
+    parser.add_argument('--profile-dir', default='profiles', help="directory for the profiles")
+    parser.add_argument('--profile-format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--plot-dir', default=None, help="write plots as PNG files to this directory instead of showing them")
+    args = parser.parse_args()
+    control = Controller(offline=args.offline, profile=args.profile, profile_dir=args.profile_dir, profile_format=args.profile_format,
+                         plot_dir=args.plot_dir)
+    control.GetStarted()
@@ -0,0 +1,77 @@
+import numpy as np
+
+CHUNK = 252 # Timesteps generated at once, bounds the memory of a batch
+
+
+class ParametricEngine():
+    """
+    Correlated random walk of the log prices: daily log returns are
+    drawn from a multivariate normal distribution with the drift and
+    covariance matrix estimated from the historical log returns
+    (days x assets).
+    """
+    def __init__(self, log_returns):
+        log_returns = np.asarray(log_returns, dtype=float)
+        self.drift = log_returns.mean(axis=0).astype(np.float32)
+        covariance = np.atleast_2d(np.cov(log_returns, rowvar=False))
+        # Eigen decomposition instead of Cholesky, the covariance of
+        # (nearly) identical assets is only positive semi-definite
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        self.factor = (eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))).T.astype(np.float32)
+        self.num_assets = len(self.drift)
+
+    def Returns(self, rng, num_paths: int, num_timesteps: int):
+        """
+        Log returns of shape (num_paths, num_timesteps, num_assets)
+        """
+        shocks = rng.standard_normal((num_paths * num_timesteps, self.num_assets), dtype=np.float32)
+        returns = shocks @ self.factor
+        returns += self.drift
+        return returns.reshape(num_paths, num_timesteps, self.num_assets)
+
+
+class BootstrapEngine():
+    """
+    Block bootstrap of the historical log returns (days x assets):
+    paths are glued together from blocks of `block` consecutive days,
+    so the correlation between assets and short-term dependence over
+    time are kept as they were.
+    """
+    def __init__(self, log_returns, block: int = 21):
+        self.log_returns = np.asarray(log_returns, dtype=np.float32)
+        self.block = min(block, len(self.log_returns))
+        self.num_assets = self.log_returns.shape[1]
+
+    def Returns(self, rng, num_paths: int, num_timesteps: int):
+        """
+        Log returns of shape (num_paths, num_timesteps, num_assets)
+        """
+        num_blocks = -(-num_timesteps // self.block)
+        starts = rng.integers(0, len(self.log_returns) - self.block + 1, (num_paths, num_blocks, 1))
+        days = (starts + np.arange(self.block)).reshape(num_paths, -1)[:, :num_timesteps]
+        return self.log_returns[days]
+
+
+def SimulateValues(engine, prices, quantities, num_simulations: int, num_timesteps: int, batch_size: int, rng):
+    """
+    Generates portfolio value paths for the given starting prices and
+    quantities of the assets. Yields batches of shape
+    (batch, num_timesteps + 1), the first column is the current value.
+    Each batch is built CHUNK timesteps at a time from one array of
+    correlated returns for all paths and assets.
+    """
+    positions = (np.asarray(prices, dtype=float) * np.asarray(quantities, dtype=float)).astype(np.float32)
+    for first in range(0, num_simulations, batch_size):
+        size = min(batch_size, num_simulations - first)
+        values = np.empty((size, num_timesteps + 1))
+        values[:, 0] = positions.sum()
+        log_prices = np.zeros((size, 1, engine.num_assets), dtype=np.float32)
+        for start in range(0, num_timesteps, CHUNK):
+            steps = min(CHUNK, num_timesteps - start)
+            returns = engine.Returns(rng, size, steps)
+            np.cumsum(returns, axis=1, out=returns)
+            returns += log_prices
+            log_prices = returns[:, -1:].copy()
+            np.exp(returns, out=returns)
+            values[:, start + 1:start + 1 + steps] = (returns.reshape(-1, engine.num_assets) @ positions).reshape(size, steps)
+        yield values
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+
+
+def WalkForwardFolds(num_rows: int, folds: int = 5, gap: int = 0, min_train: int = None):
+    """
+    Time-ordered folds over num_rows rows: every fold trains on all rows
+    before its test block (an expanding window) and tests on the next
+    block, so a model never sees days after the ones it predicts.
+    gap rows between train and test are left out, as the windows of
+    TransformData overlap look_back days. Returns a list of
+    (train_end, test_start, test_end)
+    """
+    min_train = num_rows // (folds + 1) if min_train is None else min_train
+    edges = np.linspace(min_train, num_rows, folds + 1).astype(int)
+    return [(int(start) - gap, int(start), int(end)) for start, end in zip(edges[:-1], edges[1:]) if start - gap > 0 and end > start]
+
+
+def EvaluateFold(X, y, train_end: int, test_start: int, test_end: int, params: dict):
+    """
+    Fits a forest on X[:train_end] and scores it on X[test_start:test_end].
+    Module level so it can run on a worker process
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    model = RandomForestRegressor(**params)
+    start = time.perf_counter()
+    model.fit(X[:train_end], y[:train_end])
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predicted = model.predict(X[test_start:test_end])
+    predict_seconds = time.perf_counter() - start
+    errors = predicted - y[test_start:test_end]
+    return {
+        'train_rows': train_end,
+        'test_rows': test_end - test_start,
+        'mae': float(np.abs(errors).mean()),
+        'rmse': float(np.sqrt((errors ** 2).mean())),
+        'directional_accuracy': float((np.sign(predicted) == np.sign(y[test_start:test_end])).mean()),
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+    }
+
+
+def Summarize(folds):
+    """
+    Mean of the scores and total of the times over the folds
+    """
+    if len(folds) == 0:
+        return dict()
+    summary = {name: float(np.mean([fold[name] for fold in folds])) for name in ('mae', 'rmse', 'directional_accuracy')}
+    summary.update({name: float(np.sum([fold[name] for fold in folds])) for name in ('fit_seconds', 'predict_seconds')})
+    return summary
@@ -0,0 +1,115 @@
+import numpy as np
+
+# Column order of Model.GetAssetFeatures
+COLUMNS = ['DailyChange', 'PctChange', 'LogReturns', 'Close', 'Volatility']
+DAILY_CHANGE, PCT_CHANGE, LOG_RETURNS, CLOSE, VOLATILITY = range(len(COLUMNS))
+
+
+def WindowFeatures(opens, closes, window=20):
+    """
+    NumPy version of Model.GetAssetFeatures for one or more price
+    series. opens and closes have shape (num_paths, days).
+    Returns an array of shape (num_paths, days - window, 5), the
+    rows GetAssetFeatures keeps after dropping NaN values
+    """
+    daily_change = closes[:, window:] - opens[:, window:]
+    ratio = closes[:, 1:] / closes[:, :-1]
+    pct_change = ratio[:, window - 1:] - 1
+    log_returns = np.log(ratio)
+    volatility = np.lib.stride_tricks.sliding_window_view(log_returns, window, axis=1).std(axis=-1, ddof=1) * np.sqrt(252)
+    return np.stack([daily_change, pct_change, log_returns[:, window - 1:], closes[:, window:], volatility], axis=-1)
+
+
+class FeatureState():
+    """
+    Keeps the features of the latest look_back days for a batch of
+    simulated price paths. A new price is added in constant time:
+    the log return enters a ring buffer of the last `window` returns
+    whose running sums give the rolling volatility, and the feature
+    row is written into a preallocated ring buffer.
+    Every feature row is stored twice (at i and i + look_back), so
+    the latest window is always one contiguous slice of the buffer.
+    """
+    def __init__(self, opens, closes, look_back: int, num_paths: int = 1, window: int = 20):
+        opens = np.asarray(opens, dtype=float)
+        closes = np.asarray(closes, dtype=float)
+        if len(closes) < look_back + window:
+            raise ValueError(f"Need at least {look_back + window} days of history, got {len(closes)}")
+        self.look_back = look_back
+        self.num_paths = num_paths
+        self.window = window
+
+        history = WindowFeatures(opens[None, -(look_back + window):], closes[None, -(look_back + window):], window)[0]
+        self.features = np.empty((num_paths, 2 * look_back, len(COLUMNS)))
+        self.features[:, :look_back] = history
+        self.features[:, look_back:] = history
+        self.head = 0 # Buffer position of the oldest row in the window
+
+        returns = np.log(closes[-window:] / closes[-(window + 1):-1])
+        self.returns = np.tile(returns, (num_paths, 1))
+        self.position = 0 # Ring position of the oldest log return
+        self.sum = self.returns.sum(axis=1)
+        self.sum_squares = (self.returns ** 2).sum(axis=1)
+        self.scratch = np.empty(num_paths)
+
+    def Window(self):
+        """
+        View of the latest look_back feature rows, shape
+        (num_paths, look_back, 5), oldest row first
+        """
+        return self.features[:, self.head:self.head + self.look_back]
+
+    def Latest(self):
+        """
+        View of the most recent feature row, shape (num_paths, 5)
+        """
+        return self.features[:, self.head + self.look_back - 1]
+
+    def Inputs(self):
+        """
+        Model input for the next prediction: the rows TransformData and
+        SplitData select for the latest window (every row but the most
+        recent one), flattened to shape (num_paths, (look_back - 1) * 5)
+        """
+        return self.Window()[:, :-1].reshape(self.num_paths, -1)
+
+    def Update(self, prices):
+        """
+        Adds the next close price of every path. As in the simulation
+        the open of the new day is the previous close.
+        """
+        latest = self.Latest()
+        previous = latest[:, CLOSE]
+        row = self.features[:, self.head]
+        scratch = self.scratch
+
+        np.divide(prices, previous, out=scratch)
+        np.subtract(scratch, 1, out=row[:, PCT_CHANGE])
+        np.log(scratch, out=row[:, LOG_RETURNS])
+        np.subtract(prices, previous, out=row[:, DAILY_CHANGE])
+        row[:, CLOSE] = prices
+
+        # Replace the oldest log return and update the running sums
+        log_returns = row[:, LOG_RETURNS]
+        oldest = self.returns[:, self.position]
+        self.sum += log_returns
+        self.sum -= oldest
+        self.sum_squares += log_returns ** 2
+        self.sum_squares -= oldest ** 2
+        oldest[:] = log_returns
+        self.position = (self.position + 1) % self.window
+        if self.position == 0:
+            # Resynchronise once per cycle to keep rounding errors bounded
+            self.returns.sum(axis=1, out=self.sum)
+            np.einsum('ij,ij->i', self.returns, self.returns, out=self.sum_squares)
+
+        np.multiply(self.sum, self.sum, out=scratch)
+        scratch /= self.window
+        np.subtract(self.sum_squares, scratch, out=scratch)
+        scratch /= self.window - 1
+        np.maximum(scratch, 0, out=scratch)
+        np.sqrt(scratch, out=scratch)
+        np.multiply(scratch, np.sqrt(252), out=row[:, VOLATILITY])
+
+        self.features[:, self.head + self.look_back] = row
+        self.head = (self.head + 1) % self.look_back
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import Profiler
+
+
+class Fetcher():
+    """
+    Runs one blocking request per ticker (history download, validation,
+    ...) on a bounded pool of threads. A failing request is retried
+    `retries` times, waiting backoff, 2 * backoff, 4 * backoff, ...
+    seconds in between. The time a single request may take is bounded
+    by the timeout of the request itself (see cache.FetchHistory).
+    """
+    def __init__(self, workers: int = 8, retries: int = 2, backoff: float = 0.5):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.profiler = Profiler() # Replaced by the profiler of the Model using the fetcher
+
+    def Call(self, function, ticker: str):
+        """
+        function(ticker), retried with backoff until it succeeds or the
+        retries are used up (then the last exception is raised)
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return function(ticker)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                self.profiler.Count('retries')
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def Map(self, function, tickers):
+        """
+        Calls function(ticker) for all tickers concurrently, at most
+        `workers` at the same time. Returns a dictionary ticker -> result
+        (in the order of tickers), None for the tickers that kept failing
+        """
+        tickers = list(dict.fromkeys(tickers))
+        workers = min(self.workers, len(tickers))
+        if workers <= 1:
+            results = dict()
+            for ticker in tickers:
+                try:
+                    results[ticker] = self.Call(function, ticker)
+                except Exception:
+                    results[ticker] = None
+            return results
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {ticker: executor.submit(self.Call, function, ticker) for ticker in tickers}
+        return {ticker: future.result() if future.exception() is None else None for ticker, future in futures.items()}
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class FlatForest():
+    """
+    A fitted RandomForestRegressor exported to flat NumPy arrays:
+    the nodes of all trees are concatenated, with per node the split
+    feature, threshold, left / right child and leaf value. predict
+    walks all trees for all rows at once, one level per iteration,
+    without sklearn's per-call validation and thread dispatch.
+    Only the (tree, row) pairs that have not reached a leaf yet are
+    advanced. Predictions match the sklearn forest.
+    """
+    def __init__(self, feature, threshold, left, right, value, roots, n_features: int):
+        self.leaf = left == np.arange(len(left))
+        self.children = np.stack([left, right], axis=1).ravel() # children[2 * node + go_right]
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+        self.n_features_in_ = n_features
+
+    def predict(self, X):
+        """
+        Predicts every row of X (num_rows x num_features), like
+        RandomForestRegressor.predict
+        """
+        # sklearn compares the features as float32 with float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        num_rows = len(X)
+        flat = X.ravel()
+        # One entry per (tree, row), the paths that reached a leaf drop out
+        nodes = np.repeat(self.roots, num_rows)
+        offsets = np.tile(np.arange(num_rows) * X.shape[1], len(self.roots))
+        active = np.flatnonzero(~self.leaf[nodes])
+        while len(active) > 0:
+            current = nodes[active]
+            go_right = ~(flat[offsets[active] + self.feature[current]] <= self.threshold[current])
+            current = self.children[2 * current + go_right]
+            nodes[active] = current
+            active = active[~self.leaf[current]]
+        # Add the trees one by one, like sklearn does (a sum over the
+        # tree axis may use pairwise summation and round differently)
+        leaf_values = self.value[nodes].reshape(len(self.roots), num_rows)
+        out = np.zeros(num_rows)
+        for values in leaf_values:
+            out += values
+        return out / len(self.roots)
+
+
+def Flatten(forest):
+    """
+    Exports a fitted RandomForestRegressor (single output) to a
+    FlatForest
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left < 0
+        roots.append(offset)
+        features.append(np.where(leaf, 0, tree.feature))
+        thresholds.append(np.where(leaf, 0.0, tree.threshold))
+        lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+        values.append(tree.value[:, 0, 0])
+        offset += tree.node_count
+    return FlatForest(np.concatenate(features).astype(np.intp), np.concatenate(thresholds),
+                      np.concatenate(lefts).astype(np.intp), np.concatenate(rights).astype(np.intp),
+                      np.concatenate(values), np.array(roots, dtype=np.intp), forest.n_features_in_)
@@ -1,11 +1,54 @@
-import yfinance as yf
-import pandas as pd
 import numpy as np
-import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from aggregate import PathAggregate
+from cache import HistoryCache
+from engines import ParametricEngine, BootstrapEngine, SimulateValues
+from evaluation import WalkForwardFolds, EvaluateFold, Summarize
+from fetcher import Fetcher
+from features import FeatureState, DAILY_CHANGE, CLOSE
+from forest import FlatForest, Flatten
+from portfolio import Holdings
+from prices import PriceSnapshot
+from profiler import Profiler
+from registry import ModelRegistry, DataHash
+from risk import Batches, PathRisk, HistoricalRisk
+from shards import Predict, SimulatePaths, SimulateShards
+from store import PathStore, CreateStore
+
+# yfinance, pandas and the ML libraries (sklearn) are imported where
+# they are used, so starting the application stays fast
+
+
+def FitForest(X, y, params: dict):
+    """
+    Fits the random forest of a single asset. Module level so it can
+    run on a worker process
+    """
+    from sklearn.model_selection import train_test_split
+    from sklearn.ensemble import RandomForestRegressor
 
-#ML libraries
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+    model = RandomForestRegressor(**params) # Input data is quite limited, random forest often sufficient
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+    model.fit(X_train, y_train)
+    #The accuracy is measured by Model.EvaluateModels on time-ordered folds,
+    #the random test set here has future days in the training set
+    return model
+
+
+def AddTrees(model, X, y, new_trees: int, keep: int = None):
+    """
+    Grows a fitted random forest by new_trees trees fitted on X, y
+    (warm start: the existing trees are kept as they are). With keep
+    only the first keep trees stay, the ones after them are replaced
+    """
+    if keep is not None:
+        model.estimators_ = model.estimators_[:keep]
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    model.fit(X, y)
+    return model
 
 
 class Asset():
@@ -13,16 +56,26 @@ class Asset():
     An Asset object is used within calculations and keeps track
     of the assigned features, such as the sector, class or 
     quantity.
+    The yfinance ticker handle is only created when it is first used.
     """
+    __slots__ = ('name', 'sector', 'asset_class', 'quantity', 'purchase_price', 'value', '_ticker')
+
     def __init__(self, ticker: str, sector: str, asset_class: str, quantity: int, price: float):
         self.name = ticker
-        self.ticker = yf.Ticker(ticker)
+        self._ticker = None
         self.sector = sector
         self.asset_class = asset_class
         self.quantity = quantity
         self.purchase_price = price
         self.value = 0 #Only used for prediction purposes
 
+    @property
+    def ticker(self):
+        if self._ticker is None:
+            import yfinance as yf
+            self._ticker = yf.Ticker(self.name)
+        return self._ticker
+
     def GetPrice(self):
         """
         Shorthand for if you wish to get the current price an
@@ -43,34 +96,51 @@ class Asset():
 
 
 class Model():
-    def __init__(self):
+    def __init__(self, cache: HistoryCache = None, prices: PriceSnapshot = None, registry: ModelRegistry = None, profiler: Profiler = None, fetcher: Fetcher = None):
+        # The holdings are kept twice, as Asset objects and as columns for
+        # the calculations. AddTicker is the only supported way to change
+        # them, it keeps both in sync
         self.assets = set()
+        self.holdings = Holdings()
+        self.cache = cache if cache is not None else HistoryCache()
+        self.prices = prices if prices is not None else PriceSnapshot()
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.model_keys = dict() # Registry key of the last trained model per ticker
+        self.fetcher = fetcher if fetcher is not None else Fetcher() # Concurrent requests for many tickers
+        self.profiler = profiler if profiler is not None else Profiler() # Disabled unless given
+        self.cache.profiler = self.profiler
+        self.prices.profiler = self.profiler
+        self.fetcher.profiler = self.profiler
 
     def VerifyTicker(self, ticker: str):
         """
         Checks if the ticker is valid.
         If there is any recent data on the ticker,
-        this returns true. None otherwise.
+        this returns the yf.Ticker. None otherwise.
         """
-        try:
-            hist = yf.Ticker(ticker).history(
-                period='1mo')
-            if len(hist) > 0:
-                return yf.Ticker(ticker)
-            else:
-                return None
-        except:
-            return None # If that failed, it will not exist either 
+        return self.VerifyTickers([ticker])[ticker]
+
+    def VerifyTickers(self, tickers):
+        """
+        Checks a whole list of tickers at once, the recent data of all
+        tickers is fetched concurrently (and kept in the cache).
+        Returns a dictionary ticker -> yf.Ticker, None for the invalid ones
+        """
+        import yfinance as yf
+        histories = self.GetHistories(tickers, '1mo')
+        return {ticker: yf.Ticker(ticker) if data is not None and len(data) > 0 else None for ticker, data in histories.items()}
 
     def AddTicker(self, ticker: str, sector: str, asset_class: str, quantity: int, price: float):
         """
         Given a ticker name (assumed to be validated), sector, asset class, quantity and price
         This function adds the asset to the user's portfolio
+        (to both self.assets and self.holdings)
         """
         NewAsset = Asset(ticker, sector, asset_class, quantity, price)
         #with open("portfolio.txt", 'w') as f:
         #    f.write("ticker")
         self.assets.add(NewAsset)
+        self.holdings.Add(ticker, sector, asset_class, quantity, price)
         return NewAsset
 
     def GetAssets(self):
@@ -82,42 +152,63 @@ class Model():
     def GetHistoricalData(self, ticker: str, length: str = '1y'):
         """
         Get historical data of the provided ticker (can be any)
+        Served from the local cache, which only downloads what is missing
         Returns None if the ticker does not exist
         Returns pd.dataframe otherwise
         """
         try:
-            asset = yf.Ticker(ticker)
+            with self.profiler.Phase('fetch'):
+                historical_data = self.cache.Get(ticker, length)
         except:
             return None
-        historical_data = asset.history(period=length)
         return historical_data
     
+    def GetHistories(self, tickers, length: str = '1y'):
+        """
+        GetHistoricalData for many tickers, fetched concurrently with
+        retries (see Fetcher). Returns a dictionary ticker -> pd.dataframe,
+        None for the tickers that do not exist or could not be fetched
+        """
+        with self.profiler.Phase('fetch'):
+            return self.fetcher.Map(lambda ticker: self.cache.Get(ticker, length), tickers)
+
     def GetPrice(self, ticker: str):
         """
         Get current price of the provided ticker (can be any)
+        Served from the price snapshot, see GetPrices
         Returns none if the ticker does not exist
         Returns float otherwise
         """
-        try:
-            asset = yf.Ticker(ticker)
-        except:
+        price = self.prices.GetPrice(ticker)
+        if np.isnan(price):
             return None
-        return asset.info['currentPrice']
-    
+        return price
+
+    def GetPrices(self, assets):
+        """
+        Current prices of the given assets (np.array, same order).
+        All quotes come from one snapshot, which fetches the stale
+        ones in a single bulk request.
+        """
+        return self.prices.GetPrices([asset.name for asset in assets])
+
     def GetWeight(self, ticker: Asset, all_assets: set):
         """
         Calculates the relative weight of the given asset in the
         portfolio
         """
-        total_value = 0
-        asset_value = ticker.quantity * ticker.GetPrice()
+        all_assets = list(all_assets)
+        values = self.GetPrices(all_assets + [ticker]) * np.array([asset.quantity for asset in all_assets + [ticker]])
+        return values[-1]/values[:-1].sum()
 
-        for asset in all_assets:
-            total_value += asset.quantity * asset.GetPrice()
-
-        return asset_value/total_value
+    def UpdatePrices(self):
+        """
+        Prices all portfolio lines from the price snapshot
+        """
+        with self.profiler.Phase('fetch'):
+            self.holdings.SetPrices(self.prices.GetPrices(self.holdings.tickers))
+        return self.holdings
 
-    
     def GetCalculations(self, option, asset_class = None, sector = None):
         """
         Get the components of your portfolio.
@@ -128,44 +219,134 @@ class Model():
          - value 
         of selected assets.
         """
-        calculations = list()
-        if option == 'total':
-            for asset in self.assets:
-                asset_dict = {"ticker": asset.name, "weight": round(self.GetWeight(asset, self.assets),3), "value": asset.quantity * asset.GetPrice()}
-                calculations.append(asset_dict)
-        elif option == 'class':
-            all_assets = set()
-            for asset in self.assets:
-                if asset.asset_class == asset_class:
-                    all_assets.add(asset)
-            for asset in self.assets:
-                if asset.asset_class == asset_class:
-                    asset_dict = {"ticker": asset.name, "weight": round(self.GetWeight(asset, all_assets),3), "value": asset.quantity * asset.GetPrice()}
-                    calculations.append(asset_dict)
-        elif option == 'sector':
-            all_assets = set()
-            for asset in self.assets:
-                if asset.sector == sector:
-                    all_assets.add(asset)
-            for asset in self.assets:
-                if asset.sector == sector:
-                    asset_dict = {"ticker": asset.name, "weight": round(self.GetWeight(asset, all_assets),3), "value": asset.quantity * asset.GetPrice()}
-                    calculations.append(asset_dict)
-        return calculations
+        if option not in ('total', 'class', 'sector'):
+            return list()
+        holdings = self.UpdatePrices()
+        with self.profiler.Phase('aggregate'):
+            mask = holdings.Mask(option, asset_class if option == 'class' else sector)
+            values = holdings.Values()[mask]
+            weights = values / values.sum()
+        tickers = [ticker for ticker, selected in zip(holdings.tickers, mask) if selected]
+        return [{"ticker": ticker, "weight": round(weight,3), "value": value}
+                for ticker, weight, value in zip(tickers, weights.tolist(), values.tolist())]
+
+    def GetBreakdown(self, option):
+        """
+        Value and weight of every asset class ('class') or sector
+        ('sector') at once. Returns a list of dictionaries with the
+         - label
+         - weight (within the whole portfolio)
+         - value
+        of each group.
+        """
+        holdings = self.UpdatePrices()
+        with self.profiler.Phase('aggregate'):
+            values = holdings.GroupValues(option)
+            weights = values / values.sum()
+        return [{"label": label, "weight": round(weight,3), "value": value}
+                for label, weight, value in zip(holdings.labels[option], weights.tolist(), values.tolist())]
     
     def GetPortfolioValue(self, option='total', label = 'none'):
         """
         Returns the total portfolio value
         """
-        total_value = 0
+        if option not in ('total', 'class', 'sector'):
+            return 0
+        holdings = self.UpdatePrices()
+        with self.profiler.Phase('aggregate'):
+            return float(holdings.Values()[holdings.Mask(option, label)].sum())
+
+    def GetCloseMatrix(self, length: str = '10y', join: str = 'inner'):
+        """
+        Closing prices of all assets in the portfolio as one
+        pd.DataFrame (dates x tickers), dates without time zone.
+        join='inner' keeps only the dates on which every asset traded,
+        join='outer' keeps every date on which any asset traded: an
+        asset's last close is carried over its holidays and the days
+        before its first close stay NaN
+        """
+        import pandas as pd
+
+        closes = dict()
+        histories = self.GetHistories([asset.name for asset in self.assets], length)
+        for asset in self.assets:
+            data = histories[asset.name]
+            if data is not None and len(data) > 0:
+                close = data['Close']
+                if close.index.tz is not None:
+                    close.index = close.index.tz_localize(None)
+                closes[asset.name] = close.groupby(close.index.normalize()).last()
+        if len(closes) == 0:
+            return pd.DataFrame()
+        if join == 'outer':
+            return pd.concat(closes, axis=1, join='outer').sort_index().ffill()
+        return pd.concat(closes, axis=1, join='inner').dropna()
+
+    def GetValueHistory(self, length: str = '10y', by: str = None):
+        """
+        Daily value of the current holdings over the past: the aligned
+        close matrix (see GetCloseMatrix with join='outer') times the
+        quantity of every ticker. Returns a pd.DataFrame (dates x groups)
+        with one 'Portfolio' column, or with by='sector' / 'class' one
+        column per sector / asset class. An asset adds nothing before
+        its first close.
+        """
+        import pandas as pd
+
+        closes = self.GetCloseMatrix(length, join='outer')
+        if closes.empty:
+            return pd.DataFrame()
+        values = np.nan_to_num(closes.to_numpy(dtype=float)) * self.GetQuantities(closes.columns)
+        with self.profiler.Phase('aggregate'):
+            if by is None:
+                return pd.DataFrame({'Portfolio': values.sum(axis=1)}, index=closes.index)
+            labels = dict()
+            for asset in self.assets:
+                labels.setdefault(asset.name, asset.sector if by == 'sector' else asset.asset_class)
+            groups, codes = np.unique([str(labels[ticker]) for ticker in closes.columns], return_inverse=True)
+            membership = np.zeros((len(closes.columns), len(groups)))
+            membership[np.arange(len(codes)), codes] = 1
+            return pd.DataFrame(values @ membership, index=closes.index, columns=groups)
+
+    def GetQuantities(self, tickers):
+        """
+        Total quantity held of every ticker (in the given order)
+        """
+        quantities = {ticker: 0 for ticker in tickers}
         for asset in self.assets:
-            if option == 'class' and asset.asset_class == label:
-                total_value += asset.quantity * asset.GetPrice()
-            elif option == 'sector' and asset.sector == label:
-                total_value += asset.quantity * asset.GetPrice()
-            if option == 'total':
-                total_value += asset.quantity * asset.GetPrice()
-        return total_value
+            if asset.name in quantities:
+                quantities[asset.name] += asset.quantity
+        return np.array([quantities[ticker] for ticker in tickers], dtype=float)
+
+    def GetRisk(self, num_simulations=10000, forecast_years=15, horizons=(1, 5, 15), engine='parametric', level=0.95, risk_free=0.0, store=None, look_back=60):
+        """
+        Risk figures of the portfolio. 'history' holds the return,
+        volatility, Sharpe ratio and the contribution of every ticker to
+        the variance over the last 10 years. 'simulation' holds the
+        VaR / CVaR at the horizons (in years), the maximum drawdown
+        percentiles and the return, volatility and Sharpe ratio of
+        simulated paths: those of a PathStore when store is given,
+        otherwise num_simulations paths of SimulateStream (with engine
+        and look_back). Horizons past the end of the paths are left out.
+        Returns None when there is no history of any asset
+        """
+        with self.profiler.Phase('risk'):
+            closes = self.GetCloseMatrix('10y')
+            if len(closes) < 2:
+                return None
+            history = HistoricalRisk(closes.to_numpy(dtype=float), self.GetQuantities(closes.columns), risk_free)
+            history['contribution'] = dict(zip(closes.columns, history['contribution'].tolist()))
+            if store is not None:
+                paths = self.OpenStore(store)
+                last = paths.num_timesteps - 1
+                batches = Batches(paths)
+            else:
+                last = forecast_years * 252
+                batches = self.SimulateStream(num_simulations, forecast_years, look_back, batch_size=2000, engine=engine)
+            horizons = [years for years in horizons if int(years * 252) <= last]
+            simulation = PathRisk(batches, [int(years * 252) for years in horizons], level, risk_free)
+            simulation['var'] = {years: simulation['var'][int(years * 252)] for years in horizons}
+        return {'history': history, 'simulation': simulation}
 
     def GetAssetFeatures(self, data):
         """
@@ -173,44 +354,51 @@ class Model():
         model on - daily change - percentual change - log
         returns - closing price and volatility
         """
-        df = pd.DataFrame()
+        import pandas as pd
 
-        df['DailyChange'] = data['Close'] - data['Open']
-        df['PctChange'] = data['Close'].pct_change()
-        df['LogReturns'] = np.log(data['Close'] / data['Close'].shift(1))
-        df['Close'] = data['Close']
+        with self.profiler.Phase('features'):
+            df = pd.DataFrame()
 
-        # Calculate Volatility (using a rolling standard deviation of log returns))
-        window = 20
-        df['Volatility'] = df['LogReturns'].rolling(window=window).std() * np.sqrt(252)
-        return df.dropna() # No NaN values  
+            df['DailyChange'] = data['Close'] - data['Open']
+            df['PctChange'] = data['Close'].pct_change()
+            df['LogReturns'] = np.log(data['Close'] / data['Close'].shift(1))
+            df['Close'] = data['Close']
 
-    def TransformData(self, data, look_back):
+            # Calculate Volatility (using a rolling standard deviation of log returns))
+            window = 20
+            df['Volatility'] = df['LogReturns'].rolling(window=window).std() * np.sqrt(252)
+            return df.dropna() # No NaN values  
+
+    def TransformData(self, data, look_back, latest=False, dtype=np.float64):
         """
         Creates rows with historical data included to train the 
         RF model on. Assumes that the closing price of the next 
         day is the one we want to predict and the closing of the
         previous days is everything we can know.
+        Row i holds the rows i ... i + look_back - 1 of data, the
+        column f"{column}_{day}" comes from row i + day. The rows are
+        strided views on data, only the result matrix is copied.
+        With latest=True only the last row is built (for inference).
         """
-        cols = []
-        col_names = []
-
-        # A for loop to create row wise data with history
-        # to train the regressor on
-        for day in range(look_back):
-            item = data.iloc[day:].reset_index(drop=True).copy()
-            cols.append(item)
-            for column in data.columns:
-                col_names.append(f"{column}_{day}")
-
-        merged = pd.concat(cols,ignore_index=True,axis=1)
-        merged = merged[:-look_back]
-        merged.columns = col_names
-        for col in merged.columns:
-            if "id_" in col or "index_" in col:
-                merged.drop(columns=col, inplace=True)
-
-        return merged.dropna()
+        import pandas as pd
+
+        with self.profiler.Phase('transform'):
+            # Index columns are never part of the features
+            columns = [column for column in data.columns if "id_" not in f"{column}_0" and "index_" not in f"{column}_0"]
+            col_names = [f"{column}_{day}" for day in range(look_back) for column in columns]
+            values = data[columns].to_numpy(dtype=dtype)
+            rows = len(values) - look_back
+            if rows < 1:
+                return pd.DataFrame(columns=col_names, dtype=dtype)
+
+            if latest:
+                merged = values[rows - 1:rows - 1 + look_back].reshape(1, -1)
+                return pd.DataFrame(merged, columns=col_names, index=[rows - 1], copy=False).dropna()
+
+            # windows[i, column, day] is a view on values[i + day, column]
+            windows = np.lib.stride_tricks.sliding_window_view(values, look_back, axis=0)[:rows]
+            merged = np.ascontiguousarray(windows.transpose(0, 2, 1)).reshape(rows, -1)
+            return pd.DataFrame(merged, columns=col_names, copy=False).dropna()
 
     def SplitData(self, data):
         """
@@ -221,101 +409,400 @@ class Model():
         X = data.drop(columns=['DailyChange_0', 'PctChange_0', 'LogReturns_0', 'Close_0', 'Volatility_0']) # We have every information the current day
         return X, y
 
-    def TrainModels(self, look_back=60):
+    def TrainModels(self, look_back=60, workers=None, params=None, tickers=None):
         """
         Seperate function to train random forest
         models. Used within the simulation.
         Trains a seperate model for each
-        asset within the portfolio
+        asset within the portfolio (or only the given tickers)
+        Models are fitted in parallel on `workers` processes (default:
+        one per core) and stored in the model registry. When the data,
+        look_back and hyperparameters (params) are unchanged, the stored
+        model is loaded instead of refitted.
         """
-        assets = self.assets
-        print("Training models.")
-        models = {}
+        assets = self.assets if tickers is None else [asset for asset in self.assets if asset.name in set(tickers)]
+        params = dict() if params is None else dict(params)
+        with self.registry.Locked([asset.name for asset in assets]): # Not at the same time as another thread
+            print("Training models.")
+            models = {}
+            jobs = []
+
+            histories = self.GetHistories([asset.name for asset in assets], '10y')
+            for asset in assets:
+                data = histories[asset.name]
+                if data is None or len(data) == 0:
+                    print(f"Could not prepare data for {asset.name}")
+                    continue
+                print("Retrieved historical data...")
+                trained_through = data.index[-1].strftime('%Y-%m-%d')
+                data = self.GetAssetFeatures(data)
+                print("Calculated features for historical data...")
+                data = self.TransformData(data, look_back)
+                X, y = self.SplitData(data)
+                key = self.registry.Key(asset.name, DataHash(X, y), look_back, params)
+                self.model_keys[asset.name] = key
+                model = self.registry.Load(asset.name, key)
+                if model is not None:
+                    print(f"Loaded stored model for {asset.name}")
+                    self.profiler.Count('models_loaded')
+                    models[asset.name] = model
+                    state = self.registry.LoadState(asset.name)
+                    if state is None or state['look_back'] != look_back or state['params'] != params:
+                        # Only when the state is of another look_back / params, a refreshed state is kept
+                        self.registry.SaveState(asset.name, {'key': key, 'trained_through': trained_through, 'look_back': look_back,
+                                                             'params': params, 'rows_added': 0, 'base_trees': len(model.estimators_)})
+                else:
+                    jobs.append((asset.name, key, trained_through, X, y))
+
+            if len(jobs) > 0:
+                print("Preprocessed data... now training (this can take some time!)")
+                workers = min(os.cpu_count() if workers is None else workers, len(jobs))
+                with self.profiler.Phase('fit'):
+                    if workers > 1:
+                        with ProcessPoolExecutor(max_workers=workers) as executor:
+                            fitted = list(executor.map(FitForest, [X for _, _, _, X, _ in jobs], [y for _, _, _, _, y in jobs], [params] * len(jobs)))
+                    else:
+                        fitted = [FitForest(X, y, params) for _, _, _, X, y in jobs]
+                self.profiler.Count('models_fitted', len(fitted))
+                for (name, key, trained_through, _, _), model in zip(jobs, fitted):
+                    self.registry.Save(name, key, model)
+                    # The state of a fresh model, RefreshModels adds to it
+                    self.registry.SaveState(name, {'key': key, 'trained_through': trained_through, 'look_back': look_back,
+                                                   'params': params, 'rows_added': 0, 'base_trees': len(model.estimators_)})
+                    models[name] = model
+
+            return models
+
+    def EvaluateModels(self, look_back=60, params=None, folds=5, workers=None):
+        """
+        Walk-forward backtest of the asset models: the feature matrix of
+        every asset is built once, then each forest configuration in
+        params (a dict or a list of dicts, e.g. different n_estimators)
+        is fitted and scored on time-ordered folds (see WalkForwardFolds),
+        all folds of all assets in parallel on `workers` processes.
+        Returns {ticker: [{'params', 'folds': [...], 'summary'}, ...]}
+        with MAE, RMSE, directional accuracy and fit / predict seconds.
+        """
+        configurations = [dict()] if params is None else [params] if isinstance(params, dict) else list(params)
+        names = list(dict.fromkeys(asset.name for asset in self.assets))
+        histories = self.GetHistories(names, '10y')
+        matrices = dict()
+        jobs = []
+        for name in names:
+            data = histories[name]
+            if data is None or len(data) == 0:
+                print(f"Could not prepare data for {name}")
+                continue
+            X, y = self.SplitData(self.TransformData(self.GetAssetFeatures(data), look_back))
+            matrices[name] = (X.to_numpy(dtype=np.float32), y.to_numpy(dtype=float))
+            for configuration, configuration_params in enumerate(configurations):
+                for fold in WalkForwardFolds(len(y), folds, gap=look_back):
+                    jobs.append((name, configuration, configuration_params, fold))
+
+        print(f"Evaluating {len(jobs)} folds...")
+        workers = min(os.cpu_count() if workers is None else workers, max(len(jobs), 1))
+        arguments = [[matrices[name][0] for name, _, _, _ in jobs], [matrices[name][1] for name, _, _, _ in jobs],
+                     [fold[0] for _, _, _, fold in jobs], [fold[1] for _, _, _, fold in jobs],
+                     [fold[2] for _, _, _, fold in jobs], [params for _, _, params, _ in jobs]]
+        with self.profiler.Phase('evaluate'):
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    scores = list(executor.map(EvaluateFold, *arguments))
+            else:
+                scores = list(map(EvaluateFold, *arguments))
 
-        for asset in assets:
-            model = RandomForestRegressor() # Input data is quite limited, random forest often sufficient
-            data = self.GetHistoricalData(asset.name , '10y')
-            print("Retrieved historical data...")
-            data = self.GetAssetFeatures(data)
-            print("Calculated features for historical data...")
-            data = self.TransformData(data, look_back)
-            X, y = self.SplitData(data)
-            print("Preprocessed data... now training (this can take some time!)")
-            
-            if X is not None:
-                X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
-                model.fit(X_train, y_train)
-                models[asset.name] = model
-                #We could test accuracy by predicting test set:
-                #y_pred = model.predict(X_test)
-                #error = sklearn....MeanSquaredError(y_test, y_pred)
-                #error = sklearn....MeanAbsoluteError(y_test, y_pred)
+        results = {name: [{'params': params, 'folds': []} for params in configurations] for name in matrices}
+        for (name, configuration, _, _), score in zip(jobs, scores):
+            results[name][configuration]['folds'].append(score)
+        for evaluations in results.values():
+            for evaluation in evaluations:
+                evaluation['summary'] = Summarize(evaluation['folds'])
+        return results
 
-            else:
-                print(f"Could not prepare data for {asset.name}")
+    def RefreshModels(self, look_back=60, workers=None, params=None, new_trees=10, recent=252, retrain_every=63):
+        """
+        Brings the models up to date with the latest data without
+        refitting everything on 10 years of history. Per asset the
+        registry knows the last date the model was trained through:
+        - no new days: the stored model is used as it is
+        - new days: only the features of the last `recent` rows (plus
+          look_back and the volatility window) are built and new_trees
+          trees fitted on them are added to the fully trained forest.
+          They replace the trees added by the previous refresh, so the
+          forest never has more than new_trees extra trees (and those
+          are fitted on all days since the full fit, as long as
+          retrain_every <= recent)
+        - once retrain_every days were added this way (or without a
+          stored model / with other look_back or params) the model is
+          fully retrained by TrainModels
+        Returns the models like TrainModels
+        """
+        params = dict() if params is None else dict(params)
+        names = list(dict.fromkeys(asset.name for asset in self.assets))
+        with self.registry.Locked(names): # Not at the same time as another thread
+            histories = self.GetHistories(names, '10y')
+            models = {}
+            retrain = []
+            for name in names:
+                data = histories[name]
+                state = self.registry.LoadState(name)
+                model = None
+                if data is None or len(data) == 0:
+                    continue
+                if state is not None and state['look_back'] == look_back and state['params'] == params:
+                    model = self.registry.Load(name, state['key'])
+                if model is None:
+                    retrain.append(name)
+                    continue
+                dates = data.index.strftime('%Y-%m-%d')
+                new_rows = int((dates > state['trained_through']).sum())
+                if new_rows == 0:
+                    print(f"{name} is up to date")
+                    self.profiler.Count('models_unchanged')
+                    self.model_keys[name] = state['key']
+                    models[name] = model
+                    continue
+                if state['rows_added'] + new_rows >= retrain_every:
+                    retrain.append(name)
+                    continue
+
+                # 20 extra rows for the volatility window (and the first log return)
+                rows = max(new_rows, recent)
+                tail = data.iloc[-(rows + look_back + 20):]
+                X, y = self.SplitData(self.TransformData(self.GetAssetFeatures(tail), look_back))
+                base_trees = state.get('base_trees', len(model.estimators_)) # States of older versions had no base_trees
+                with self.profiler.Phase('fit'):
+                    model = AddTrees(model, X, y, new_trees, keep=base_trees)
+                self.profiler.Count('models_updated')
+                key = self.registry.Key(name, f"{state['key']}+{dates[-1]}", look_back, params)
+                self.registry.Save(name, key, model)
+                self.registry.SaveState(name, {'key': key, 'trained_through': dates[-1], 'look_back': look_back,
+                                               'params': params, 'rows_added': state['rows_added'] + new_rows, 'base_trees': base_trees})
+                self.model_keys[name] = key
+                print(f"Updated the model of {name} with {new_trees} new trees ({new_rows} new days)")
+                models[name] = model
+
+            if len(retrain) > 0:
+                models.update(self.TrainModels(look_back, workers, params, tickers=retrain))
+            return models
+
+    def FlattenModels(self, models):
+        """
+        Exports the random forests in models to FlatForests, which
+        are much faster to call on a few rows at a time
+        """
+        return {name: model if isinstance(model, FlatForest) else Flatten(model) for name, model in models.items()}
 
-        return models
+    def Predict(self, model, X):
+        """
+        Predicts the rows of the feature matrix X (np.array) with a
+        random forest or a FlatForest (see shards.Predict)
+        """
+        return Predict(model, X, self.profiler)
 
-    def SimulatePortfolio(self, num_simulations=10, forecast_years=15, look_back=30):
+    def SimulatePortfolio(self, num_simulations=10, forecast_years=15, look_back=30, batched=True, flat=True, store=None, **options):
         """
         This function first trains a rf regressor based on historical price data
+        (or refreshes the stored one, see RefreshModels)
         It then simulates step by step behaviour of the index
-        This way, a simulation takes +- 2 min -> therefore less than 
-        100_000 simulations are suggested.
+        In the (default) batched mode all simulations are moved forward
+        together, see SimulateBatch. With batched=False every simulation
+        is run on its own, which takes +- 2 min per simulation.
+        With flat=True the forests are evaluated as FlatForests.
+        With store (a .npy path) the paths are written to disk instead
+        of returned, see SimulateToStore (which takes the options).
         """
+        if store is not None:
+            return self.SimulateToStore(store, num_simulations, forecast_years, look_back, flat=flat, **options)
+        if batched:
+            return self.SimulateBatch(num_simulations, forecast_years, look_back, flat=flat)
+
         num_timesteps = forecast_years * 252 # Number of trading days each year
         portfolio_futures = []
         assets = self.assets
-        models = self.TrainModels(look_back)
+        models = self.RefreshModels(look_back)
+        if flat:
+            models = self.FlattenModels(models)
+        histories = self.GetHistories([asset.name for asset in assets], '2y')
         print("Calculating simulations...")
-        
-        start = datetime.datetime.now()
-
-        for sim in range(num_simulations):
-            print("Simulation:", sim)
-            portfolio_values = [sum(asset.quantity * asset.value for asset in assets)]
-            #^ Copy by value so they don't get overwritten
-        
-            asset_sequences = dict() # A dictionary which keeps track of all sequences per asset
-            calc_sequences = dict()
-            for asset in assets:
-                data = self.GetHistoricalData(asset.name, '2y')
-                #We use calc_sequences to create the feature data with
-                #Features such as the volatility requires a look-back window
-                calc_sequences[asset.name] = data[['Open', 'Close']].reset_index()
-                #And this is for the true prediction purposes
-                data = self.GetAssetFeatures(calc_sequences[asset.name])
-                asset_sequences[asset.name] = data.reset_index(drop=True)
-            ts_start = datetime.datetime.now()
-            for t in range(num_timesteps):
-                values = []
+
+        with self.profiler.Phase('simulate'):
+            for sim in range(num_simulations):
+                print("Simulation:", sim)
+                portfolio_values = [sum(asset.quantity * asset.value for asset in assets)]
+                #^ Copy by value so they don't get overwritten
+
+                states = dict() # Rolling feature state per asset
                 for asset in assets:
-                    if asset.name in models:
-                        last_sequence = asset_sequences[asset.name].iloc[-(look_back+1):].copy()
-                        X = self.TransformData(pd.DataFrame(last_sequence), look_back)
-                        X = X.iloc[[-1]] #get the last row
-                        X, _ = self.SplitData(X)
-                        predicted_change = models[asset.name].predict(X) # Predicted closing price for the next day by the model
-                        randomness = np.random.normal(0, min(abs(asset_sequences[asset.name]['DailyChange'].iloc[-1]*2), 11)) # Add random element (rf is deterministic otherwise)
+                    data = histories[asset.name]
+                    #Features such as the volatility requires a look-back window
+                    states[asset.name] = FeatureState(data['Open'], data['Close'], look_back)
+                for t in range(num_timesteps):
+                    values = []
+                    for asset in assets:
+                        if asset.name in models:
+                            state = states[asset.name]
+                            predicted_change = self.Predict(models[asset.name], state.Inputs()) # Predicted closing price for the next day by the model
+                            randomness = np.random.normal(0, min(abs(state.Latest()[0, DAILY_CHANGE]*2), 11)) # Add random element (rf is deterministic otherwise)
+
+                            predicted_change += randomness
+                            new_price = state.Latest()[0, CLOSE] + predicted_change #Predicted price for the next day
+
+                            if new_price <= 0:
+                                new_price = 0.000001 #Non-zero prices.
+                            values.append(asset.quantity * new_price)
+                            with self.profiler.Phase('features'):
+                                state.Update(new_price) # The open of the new day is the last close
+
+                    current_portfolio_value = sum(values)
+                    portfolio_values.append(current_portfolio_value)
+                portfolio_futures.append(portfolio_values)
 
-                        predicted_change += randomness
-                        new_price = asset_sequences[asset.name]['Close'].iloc[-1] + predicted_change #Predicted price for the next day
+        return portfolio_futures
 
-                        if new_price <= 0:
-                            new_price = 0.000001 #Non-zero prices.
-                        values.append(asset.quantity * new_price)
+    def SimulateBatch(self, num_simulations=10, forecast_years=15, look_back=30, models=None, flat=True, engine='rf'):
+        """
+        Simulates all paths at once. Per timestep there is a single
+        predict call per asset on a (num_simulations x features) matrix
+        and the randomness is drawn as one array, so the cost of a
+        timestep hardly depends on the number of simulations.
+        Returns an array of shape (num_simulations, num_timesteps + 1)
+        where the first column holds the current portfolio value.
+        """
+        with self.profiler.Phase('simulate'):
+            batches = list(self.SimulateStream(num_simulations, forecast_years, look_back, max(num_simulations, 1), models, flat, engine))
+            portfolio_futures = np.concatenate(batches) if batches else np.zeros((0, forecast_years * 252 + 1))
+
+        return portfolio_futures
 
-                        new_row = pd.DataFrame({"Open": asset_sequences[asset.name]['Close'].iloc[[-1]], "Close": new_price}) # Wrong assumptionn
-                        calc_sequences[asset.name] = pd.concat([calc_sequences[asset.name], new_row], ignore_index=True).iloc[-(look_back*2):]
-                        asset_sequences[asset.name] = self.GetAssetFeatures(calc_sequences[asset.name])
+    def SimulateStream(self, num_simulations=10, forecast_years=15, look_back=30, batch_size=1000, models=None, flat=True, engine='rf', workers=None, seed=None):
+        """
+        Generator version of SimulateBatch: simulates the paths in
+        batches of batch_size and yields every batch (an array of shape
+        (batch, num_timesteps + 1)) as soon as it is done, so only one
+        batch has to be kept in memory.
+        engine selects how prices move: 'rf' (the random forests),
+        'parametric' or 'bootstrap' (see SimulateReturns).
+        Without models, the stored models are brought up to date with
+        RefreshModels first.
+        With workers or a seed the batches are simulated as shards on
+        `workers` processes, with random streams derived from seed (see
+        shards.SimulateShards). The paths only depend on the seed and
+        batch_size, not on the number of workers.
+        """
+        if engine != 'rf':
+            yield from self.SimulateReturns(num_simulations, forecast_years, batch_size, engine, seed=seed)
+            return
 
-                current_portfolio_value = sum(values)
-                portfolio_values.append(current_portfolio_value)
-            print(f"Simulation {sim} time {datetime.datetime.now() - ts_start}")
-            portfolio_futures.append(portfolio_values)
+        num_timesteps = forecast_years * 252 # Number of trading days each year
+        if models is None:
+            models = self.RefreshModels(look_back)
+        if flat:
+            models = self.FlattenModels(models)
+        assets = [asset for asset in self.assets if asset.name in models]
+        histories = self.GetHistories([asset.name for asset in assets], '2y')
+        for asset in assets:
+            asset.SetValue(histories[asset.name]['Close'].iloc[-1])
+        opens = [histories[asset.name]['Open'].to_numpy(dtype=float) for asset in assets]
+        closes = [histories[asset.name]['Close'].to_numpy(dtype=float) for asset in assets]
+        quantities = [asset.quantity for asset in assets]
+        print("Calculating simulations...")
 
-        t_time = datetime.datetime.now() - start
-        print(f"Elapsed time: ", {t_time})
+        if workers is not None or seed is not None:
+            yield from SimulateShards([models[asset.name] for asset in assets], opens, closes, quantities, look_back,
+                                      num_simulations, num_timesteps, batch_size, workers, seed, self.profiler)
+            return
+        for first in range(0, num_simulations, batch_size):
+            size = min(batch_size, num_simulations - first)
+            yield SimulatePaths([models[asset.name] for asset in assets], opens, closes, quantities, look_back,
+                                size, num_timesteps, predict=self.Predict, profiler=self.profiler)
 
-        return portfolio_futures
+    def SimulateToStore(self, path, num_simulations=10, forecast_years=15, look_back=30, batch_size=1000, flat=True, engine='rf', workers=None, seed=None):
+        """
+        Runs SimulateStream and writes every batch straight into a
+        preallocated float32 PathStore at path, so the paths never have
+        to fit in memory. The store keeps the tickers, quantities,
+        horizon, seed and models next to the paths. Without a seed a
+        random one is drawn (and stored), so the run can be repeated.
+        Returns the PathStore
+        """
+        seed = np.random.SeedSequence().entropy if seed is None else seed
+        assets = list(self.assets)
+        metadata = {
+            'tickers': [asset.name for asset in assets],
+            'quantities': [asset.quantity for asset in assets],
+            'forecast_years': forecast_years,
+            'look_back': look_back,
+            'engine': engine,
+            'seed': seed,
+            'batch_size': batch_size,
+            'created': time.time(),
+        }
+        store = CreateStore(path, num_simulations, forecast_years * 252 + 1, metadata)
+        with self.profiler.Phase('simulate'):
+            first = 0
+            for paths in self.SimulateStream(num_simulations, forecast_years, look_back, batch_size, None, flat, engine, workers, seed):
+                store.Write(first, paths)
+                first += len(paths)
+        if engine == 'rf':
+            store.metadata['models'] = {asset.name: self.model_keys.get(asset.name) for asset in assets}
+        store.Flush()
+        return store
+
+    def OpenStore(self, path):
+        """
+        Reopens the paths of an earlier SimulateToStore (read only)
+        """
+        return PathStore(path)
+
+    def SimulateReturns(self, num_simulations=10, forecast_years=15, batch_size=1000, engine='parametric', block=21, seed=None):
+        """
+        Fast alternative to the random forests, without any model.
+        'parametric' draws correlated daily log returns from a normal
+        distribution with the drift and covariance of the last 10 years,
+        'bootstrap' glues together blocks of `block` historical days.
+        Either way all paths of all assets are generated as one array,
+        the shocks of the assets are correlated like they were in the past.
+        Yields batches like SimulateStream.
+        """
+        if engine not in ('parametric', 'bootstrap'):
+            raise ValueError(f"Unknown simulation engine {engine}")
+        with self.profiler.Phase('fetch'):
+            closes = self.GetCloseMatrix('10y')
+        for asset in self.assets:
+            if asset.name not in closes.columns:
+                print(f"Could not prepare data for {asset.name}")
+        num_timesteps = forecast_years * 252
+        if len(closes) == 0:
+            # Nothing to simulate, the portfolio is worth nothing on every path
+            for first in range(0, num_simulations, batch_size):
+                yield np.zeros((min(batch_size, num_simulations - first), num_timesteps + 1))
+            return
+        log_returns = np.diff(np.log(closes.to_numpy(dtype=float)), axis=0)
+        if engine == 'parametric':
+            generator = ParametricEngine(log_returns)
+        else:
+            generator = BootstrapEngine(log_returns, block)
+        prices = closes.to_numpy(dtype=float)[-1]
+        for asset in self.assets:
+            if asset.name in closes.columns:
+                asset.SetValue(closes[asset.name].iloc[-1])
+        print("Calculating simulations...")
+        rng = np.random.default_rng(seed)
+        yield from SimulateValues(generator, prices, self.GetQuantities(closes.columns),
+                                  num_simulations, num_timesteps, batch_size, rng)
+
+    def SimulateAggregate(self, num_simulations=10, forecast_years=15, look_back=30, batch_size=1000, models=None, percentiles=(5, 50, 95), flat=True, engine='rf', workers=None, seed=None):
+        """
+        Runs SimulateStream and only keeps per-timestep statistics
+        (mean, min / max and approximate percentiles) of the paths.
+        Memory does not grow with the number of simulations.
+        Returns a PathAggregate
+        """
+        with self.profiler.Phase('simulate'):
+            aggregate = PathAggregate(forecast_years * 252 + 1, percentiles)
+            for paths in self.SimulateStream(num_simulations, forecast_years, look_back, batch_size, models, flat, engine, workers, seed):
+                with self.profiler.Phase('aggregate'):
+                    aggregate.Add(paths)
 
+        return aggregate
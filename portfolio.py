@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class Holdings():
+    """
+    Columnar store of the portfolio lines. Quantities and prices are
+    kept in NumPy arrays and the sector and asset class of every line
+    as integer codes, so values and weights of all sectors or classes
+    are computed at once with a group-by (np.bincount).
+    """
+    def __init__(self, capacity: int = 16):
+        self.size = 0
+        self.tickers = list()
+        self.quantity = np.zeros(capacity)
+        self.purchase_price = np.zeros(capacity)
+        self.price = np.full(capacity, np.nan) # Current price, NaN until priced
+        self.codes = {'sector': np.zeros(capacity, dtype=np.int32), 'class': np.zeros(capacity, dtype=np.int32)}
+        self.labels = {'sector': list(), 'class': list()}
+        self.label_codes = {'sector': dict(), 'class': dict()}
+
+    def __len__(self):
+        return self.size
+
+    def Grow(self):
+        """
+        Doubles the capacity of the arrays
+        """
+        capacity = 2 * len(self.quantity)
+        self.quantity = np.resize(self.quantity, capacity)
+        self.purchase_price = np.resize(self.purchase_price, capacity)
+        self.price = np.resize(self.price, capacity)
+        for by in self.codes:
+            self.codes[by] = np.resize(self.codes[by], capacity)
+
+    def Code(self, by: str, label):
+        """
+        Returns the code of a sector / class label, -1 if unknown
+        """
+        return self.label_codes[by].get(label, -1)
+
+    def Add(self, ticker: str, sector: str, asset_class: str, quantity: int, price: float):
+        """
+        Appends a portfolio line, returns its row
+        """
+        if self.size == len(self.quantity):
+            self.Grow()
+        row = self.size
+        self.tickers.append(ticker)
+        self.quantity[row] = quantity
+        self.purchase_price[row] = price
+        self.price[row] = np.nan
+        for by, label in (('sector', sector), ('class', asset_class)):
+            if label not in self.label_codes[by]:
+                self.label_codes[by][label] = len(self.labels[by])
+                self.labels[by].append(label)
+            self.codes[by][row] = self.label_codes[by][label]
+        self.size += 1
+        return row
+
+    def SetPrices(self, prices):
+        """
+        Sets the current price of every line (same order as tickers)
+        """
+        self.price[:self.size] = prices
+
+    def Values(self):
+        """
+        Current value of every line
+        """
+        return self.quantity[:self.size] * self.price[:self.size]
+
+    def Mask(self, by: str = 'total', label=None):
+        """
+        Boolean mask of the lines in the given sector / class,
+        all lines for by='total'
+        """
+        if by == 'total':
+            return np.ones(self.size, dtype=bool)
+        return self.codes[by][:self.size] == self.Code(by, label)
+
+    def GroupValues(self, by: str):
+        """
+        Total value per sector / class, as an array ordered like
+        self.labels[by]
+        """
+        return np.bincount(self.codes[by][:self.size], weights=self.Values(), minlength=len(self.labels[by]))
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import numpy as np
+
+from profiler import Profiler
+
+
+def FetchQuotes(tickers):
+    """
+    Latest price of every ticker, fetched in one bulk request.
+    Returns a dictionary ticker -> price, tickers without any
+    recent data are left out
+    """
+    import yfinance as yf
+    data = yf.download(list(tickers), period='5d', progress=False, group_by='column')
+    closes = data['Close'].ffill().iloc[-1]
+    return {ticker: float(price) for ticker, price in closes.items() if not np.isnan(price)}
+
+
+class PriceSnapshot():
+    """
+    Snapshot of current prices shared by all valuation methods.
+    Quotes are fetched in bulk and reused until they are older
+    than max_age seconds. Stale or unknown tickers are fetched
+    together in a single request.
+    fetch can be replaced by any function with the signature of
+    FetchQuotes. The snapshot can be shared by threads.
+    """
+    def __init__(self, max_age: float = 60, fetch=FetchQuotes):
+        self.max_age = max_age
+        self.fetch = fetch
+        self.profiler = Profiler() # Replaced by the profiler of the Model using the snapshot
+        self.prices = dict()
+        self.fetched_at = dict()
+        self.lock = threading.RLock()
+
+    def Refresh(self, tickers):
+        """
+        Fetches the quotes of all given tickers in one request
+        """
+        tickers = list(dict.fromkeys(tickers))
+        if len(tickers) == 0:
+            return
+        with self.lock:
+            self.profiler.Count('network_calls')
+            quotes = self.fetch(tickers)
+            now = time.time()
+            for ticker in tickers:
+                self.prices[ticker] = quotes.get(ticker, np.nan)
+                self.fetched_at[ticker] = now
+
+    def GetPrices(self, tickers):
+        """
+        Returns the prices of the given tickers as a np.array (in the
+        same order), NaN for tickers without a quote
+        """
+        tickers = list(tickers)
+        with self.lock:
+            now = time.time()
+            stale = [ticker for ticker in tickers if now - self.fetched_at.get(ticker, -np.inf) > self.max_age]
+            self.profiler.Count('cache_hits', len(tickers) - len(stale))
+            self.Refresh(stale)
+            return np.array([self.prices[ticker] for ticker in tickers], dtype=float)
+
+    def GetPrice(self, ticker: str):
+        """
+        Returns the price of a single ticker, NaN without a quote
+        """
+        return self.GetPrices([ticker])[0]
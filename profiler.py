@@ -0,0 +1,99 @@
+import contextlib
+import csv
+import json
+import time
+from collections import defaultdict
+
+NO_PHASE = contextlib.nullcontext()
+
+
+class PhaseTimer():
+    """
+    Context manager that adds its wall-clock time to a phase
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.seconds[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+        return False
+
+
+class Profiler():
+    """
+    Per-phase timers (fetch, features, transform, fit, predict,
+    aggregate, ...) and counters (network calls, cache hits, predict
+    calls, rows predicted, ...) of a run. Phases are inclusive, a
+    phase inside another one is counted in both.
+    When disabled, Phase returns a shared no-op context and Count
+    returns immediately, so instrumented code runs at full speed.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.Reset()
+
+    def Reset(self):
+        self.started = time.time()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def Phase(self, name: str):
+        """
+        Times the enclosed block: with profiler.Phase('fit'): ...
+        """
+        if not self.enabled:
+            return NO_PHASE
+        return PhaseTimer(self, name)
+
+    def Count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def Merge(self, report: dict):
+        """
+        Adds the phases and counters of another profiler's Report,
+        e.g. of a worker process
+        """
+        if not self.enabled:
+            return
+        for name, phase in report['phases'].items():
+            self.seconds[name] += phase['seconds']
+            self.calls[name] += phase['calls']
+        for name, value in report['counters'].items():
+            self.counters[name] += value
+
+    def Report(self):
+        """
+        Returns the timings and counters as a dictionary
+        """
+        return {
+            'started': self.started,
+            'phases': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in self.seconds},
+            'counters': dict(self.counters),
+        }
+
+    def Export(self, path: str):
+        """
+        Writes the report to path, as CSV if it ends with .csv
+        and as JSON otherwise
+        """
+        report = self.Report()
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['kind', 'name', 'seconds', 'count'])
+                for name, phase in report['phases'].items():
+                    writer.writerow(['phase', name, phase['seconds'], phase['calls']])
+                for name, value in report['counters'].items():
+                    writer.writerow(['counter', name, '', value])
+            else:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,146 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'models')
+
+
+def DataHash(X, y):
+    """
+    Hash of a training set (feature matrix and target), used to
+    recognise when a model can be reused
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in X.columns]).encode())
+    digest.update(X.to_numpy(dtype=float).tobytes())
+    digest.update(y.to_numpy(dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+class ModelRegistry():
+    """
+    Stores fitted models on disk so later sessions can load them
+    instead of refitting. A model is identified by its ticker, the
+    hash of its training data, look_back and the hyperparameters;
+    only the latest model of every ticker is kept on disk.
+    Next to the models it keeps a small state per ticker (the key of
+    the latest model and the last date it was trained on), used to
+    refresh the models incrementally.
+    A registry can be shared between threads (e.g. the jobs of the
+    service): every file is written through its own temporary file and
+    Locked serialises the work on the models of a ticker.
+    """
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ticker_locks = dict()
+        os.makedirs(path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def Locked(self, tickers):
+        """
+        Holds the lock of every ticker in tickers (re-entrant, taken in
+        sorted order so two threads can not wait on each other)
+        """
+        with self.lock:
+            locks = [self.ticker_locks.setdefault(ticker, threading.RLock()) for ticker in sorted(set(tickers))]
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+    def Replace(self, file: str, write):
+        """
+        Calls write(path) on a new temporary file next to file and then
+        moves it into place, so readers never see a partial file
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(handle)
+        try:
+            write(temporary)
+            os.replace(temporary, file)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+            raise
+
+    def Key(self, ticker: str, data_hash: str, look_back: int, params: dict):
+        """
+        Returns the registry key of a model
+        """
+        import sklearn
+        description = json.dumps([ticker, data_hash, look_back, params, sklearn.__version__], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def File(self, ticker: str, key: str):
+        name = ticker.replace(os.sep, '_')
+        return os.path.join(self.path, f"{name}-{key[:24]}.joblib")
+
+    def StateFile(self, ticker: str):
+        name = ticker.replace(os.sep, '_')
+        return os.path.join(self.path, f"{name}-state.json")
+
+    def LoadState(self, ticker: str):
+        """
+        Returns the state of the latest model of ticker as a
+        dictionary, None if it was never stored
+        """
+        try:
+            with open(self.StateFile(ticker)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def SaveState(self, ticker: str, state: dict):
+        def Write(path):
+            with open(path, 'w') as f:
+                json.dump(state, f, indent=2, default=str)
+        self.Replace(self.StateFile(ticker), Write)
+
+    def Load(self, ticker: str, key: str):
+        """
+        Returns the stored model, None if there is none (or if it
+        can not be read anymore)
+        """
+        import joblib
+
+        file = self.File(ticker, key)
+        if not os.path.exists(file):
+            return None
+        try:
+            return joblib.load(file)
+        except Exception:
+            return None
+
+    def Files(self, ticker: str):
+        """
+        All model files stored for ticker
+        """
+        prefix = ticker.replace(os.sep, '_') + '-'
+        files = []
+        for entry in os.listdir(self.path):
+            # The key part is exactly 24 characters, so "BRK" does not match "BRK-B"
+            if entry.startswith(prefix) and entry.endswith('.joblib') and len(entry) == len(prefix) + 24 + len('.joblib'):
+                files.append(os.path.join(self.path, entry))
+        return files
+
+    def Save(self, ticker: str, key: str, model):
+        """
+        Stores a fitted model. Written to a temporary file first so
+        an interrupted save never leaves a broken model behind.
+        Only the latest model of a ticker is kept: its older files are
+        removed (the data hash in the key changes every trading day)
+        """
+        import joblib
+
+        file = self.File(ticker, key)
+        self.Replace(file, lambda path: joblib.dump(model, path))
+        for old in self.Files(ticker):
+            if old != file:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
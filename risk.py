@@ -0,0 +1,91 @@
+import numpy as np
+
+TRADING_DAYS = 252
+
+
+def Batches(paths, batch_size: int = 10000):
+    """
+    Yields the rows of a path matrix (array, memmap or PathStore)
+    batch_size at a time, so only one batch is in memory
+    """
+    for first in range(0, len(paths), batch_size):
+        yield np.asarray(paths[first:first + batch_size], dtype=float)
+
+
+def ValueAtRisk(returns, level: float = 0.95):
+    """
+    VaR and CVaR (expected shortfall) of the losses of an array of
+    returns, at confidence level. Both are returned as positive losses
+    (a VaR of 0.2 means 20% is lost in the worst 1 - level cases)
+    """
+    losses = -np.asarray(returns, dtype=float)
+    var = np.quantile(losses, level)
+    tail = losses[losses >= var]
+    return float(var), float(tail.mean()) if len(tail) > 0 else float(var)
+
+
+def MaxDrawdowns(paths):
+    """
+    Largest fall from a running peak of every path, as a fraction of
+    that peak. paths has shape (num_paths, num_timesteps)
+    """
+    peaks = np.maximum.accumulate(paths, axis=1)
+    return (1 - paths / peaks).max(axis=1)
+
+
+def PathRisk(batches, horizons, level: float = 0.95, risk_free: float = 0.0):
+    """
+    Risk figures of simulated portfolio values, from an iterable of
+    batches (num_paths x num_timesteps, column 0 the current value):
+    VaR / CVaR of the return at every horizon (in trading days), the
+    distribution of the maximum drawdown and the annualized return,
+    volatility and Sharpe ratio of the daily log returns.
+    Only the horizon columns and one drawdown per path are kept.
+    """
+    horizon_returns, drawdowns = [], []
+    count, total, total_squares = 0, 0.0, 0.0
+    for paths in batches:
+        horizon_returns.append(paths[:, horizons] / paths[:, :1] - 1)
+        drawdowns.append(MaxDrawdowns(paths))
+        log_returns = np.diff(np.log(np.maximum(paths, 1e-6)), axis=1)
+        count += log_returns.size
+        total += log_returns.sum()
+        total_squares += (log_returns ** 2).sum()
+    horizon_returns = np.concatenate(horizon_returns)
+    drawdowns = np.concatenate(drawdowns)
+
+    mean = total / count * TRADING_DAYS
+    volatility = np.sqrt(max(total_squares / count - (total / count) ** 2, 0) * TRADING_DAYS)
+    report = {
+        'paths': len(drawdowns),
+        'var': {horizon: ValueAtRisk(horizon_returns[:, i], level) for i, horizon in enumerate(horizons)},
+        'max_drawdown': {percentile: float(value) for percentile, value in zip((5, 50, 95), np.percentile(drawdowns, (5, 50, 95)))},
+        'return': float(mean),
+        'volatility': float(volatility),
+        'sharpe': float((mean - risk_free) / volatility) if volatility > 0 else np.nan,
+    }
+    return report
+
+
+def HistoricalRisk(closes, quantities, risk_free: float = 0.0):
+    """
+    Risk of the current portfolio over the past, from the close matrix
+    (days x assets) and the quantity held of every asset: annualized
+    return, volatility and Sharpe ratio of the daily log returns, and
+    the share of every asset in the portfolio variance (sums to 1)
+    """
+    closes = np.asarray(closes, dtype=float)
+    positions = closes[-1] * np.asarray(quantities, dtype=float)
+    weights = positions / positions.sum()
+    log_returns = np.diff(np.log(closes), axis=0)
+    covariance = np.atleast_2d(np.cov(log_returns, rowvar=False)) * TRADING_DAYS
+    marginal = covariance @ weights
+    variance = weights @ marginal
+    mean = log_returns.mean(axis=0) @ weights * TRADING_DAYS
+    volatility = np.sqrt(variance)
+    return {
+        'return': float(mean),
+        'volatility': float(volatility),
+        'sharpe': float((mean - risk_free) / volatility) if volatility > 0 else np.nan,
+        'contribution': weights * marginal / variance if variance > 0 else np.full(len(weights), np.nan),
+    }
@@ -0,0 +1,264 @@
+"""
+Local portfolio service. Keeps a Model per portfolio in memory, all
+sharing one history cache, price snapshot and model registry, and
+answers JSON requests over HTTP on localhost. Valuations are answered
+right away, simulations run as jobs on a background pool.
+
+    python service.py [--port 8765] [--offline] [--synthetic] [--workers 2]
+
+    GET  /portfolios                           names of the portfolios
+    POST /portfolios/<name>/assets             {"ticker", "sector", "class", "quantity", "price"}
+    GET  /portfolios/<name>                    value, assets and breakdown per class / sector
+    POST /portfolios/<name>/simulations        {"simulations", "years", "engine", "seed"} -> {"job"}
+    GET  /jobs/<id>                            status of a job, with the result when done
+
+A portfolio is created by adding its first asset, the other requests
+answer 404 for an unknown portfolio. Errors are replied as {"error"}.
+
+--synthetic serves a SyntheticMarket instead of Yahoo Finance, so the
+service can be tried and tested without network access.
+"""
+import argparse
+import itertools
+import json
+import math
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import HistoryCache
+from model import Model
+from prices import PriceSnapshot
+from registry import ModelRegistry
+
+ENGINES = ('rf', 'parametric', 'bootstrap')
+
+
+def Finite(body):
+    """
+    body with every NaN or infinite float replaced by None, as JSON
+    has no such numbers
+    """
+    if isinstance(body, float):
+        return body if math.isfinite(body) else None
+    if isinstance(body, dict):
+        return {key: Finite(value) for key, value in body.items()}
+    if isinstance(body, (list, tuple)):
+        return [Finite(value) for value in body]
+    return body
+
+
+class Service():
+    """
+    The portfolios and simulation jobs of the service. Every portfolio
+    has a lock; a simulation runs on a copy of the portfolio, so it
+    can change (and be valued) while the simulation is running.
+    """
+    def __init__(self, cache: HistoryCache = None, prices: PriceSnapshot = None, registry: ModelRegistry = None, workers: int = 2):
+        self.cache = cache if cache is not None else HistoryCache()
+        self.prices = prices if prices is not None else PriceSnapshot()
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.portfolios = dict()
+        self.locks = dict()
+        self.jobs = dict()
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def NewModel(self):
+        return Model(cache=self.cache, prices=self.prices, registry=self.registry)
+
+    def Portfolio(self, name: str, create: bool = False):
+        """
+        The Model and lock of a portfolio, (None, None) if it does not
+        exist. With create a new portfolio is made for an unknown name
+        """
+        with self.lock:
+            if name not in self.portfolios:
+                if not create:
+                    return None, None
+                self.portfolios[name] = self.NewModel()
+                self.locks[name] = threading.Lock()
+            return self.portfolios[name], self.locks[name]
+
+    def AddAsset(self, name: str, ticker: str, sector: str, asset_class: str, quantity: int, price: float):
+        model, lock = self.Portfolio(name, create=True)
+        with lock:
+            model.AddTicker(ticker, sector, asset_class, quantity, price)
+        return self.Value(name)
+
+    def Value(self, name: str):
+        """
+        Current value of the portfolio, per asset and per class / sector.
+        None if there is no such portfolio
+        """
+        model, lock = self.Portfolio(name)
+        if model is None:
+            return None
+        with lock:
+            assets = list(model.GetAssets())
+            prices = model.GetPrices(assets)
+            return {
+                'portfolio': name,
+                'value': model.GetPortfolioValue(),
+                'assets': [{'ticker': asset.name, 'sector': asset.sector, 'class': asset.asset_class,
+                            'quantity': asset.quantity, 'price': None if price != price else float(price)}
+                           for asset, price in zip(assets, prices)],
+                'class': model.GetBreakdown('class') if len(assets) > 0 else [],
+                'sector': model.GetBreakdown('sector') if len(assets) > 0 else [],
+            }
+
+    def Submit(self, name: str, num_simulations: int = 1000, forecast_years: int = 15, engine: str = 'parametric', seed=None):
+        """
+        Queues a simulation of the portfolio as it is now and returns
+        the job id, None if there is no such portfolio
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown simulation engine {engine}")
+        if num_simulations <= 0 or forecast_years <= 0:
+            raise ValueError("simulations and years must be positive")
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+            raise ValueError("seed must be a non-negative integer or null")
+        model, lock = self.Portfolio(name)
+        if model is None:
+            return None
+        copy = self.NewModel()
+        with lock:
+            for asset in model.GetAssets():
+                copy.AddTicker(asset.name, asset.sector, asset.asset_class, asset.quantity, asset.purchase_price)
+        job = str(next(self.job_ids))
+        with self.lock:
+            self.jobs[job] = {'job': job, 'portfolio': name, 'status': 'queued', 'submitted': time.time()}
+        self.executor.submit(self.Run, job, copy, num_simulations, forecast_years, engine, seed)
+        return job
+
+    def Run(self, job: str, model: Model, num_simulations: int, forecast_years: int, engine: str, seed):
+        """
+        Runs a simulation job on the pool: the mean and the 5 / 50 / 95
+        percentiles of the portfolio value at the end of every year
+        """
+        with self.lock:
+            self.jobs[job]['status'] = 'running'
+        try:
+            aggregate = model.SimulateAggregate(num_simulations, forecast_years, 60, batch_size=1000, engine=engine, seed=seed)
+            years = slice(0, aggregate.num_timesteps, 252)
+            result = {'paths': aggregate.count, 'years': list(range(forecast_years + 1)), 'mean': aggregate.Mean()[years].tolist()}
+            result.update({f"p{percentile}": values[years].tolist() for percentile, values in aggregate.Percentiles().items()})
+            with self.lock:
+                self.jobs[job].update({'status': 'done', 'result': result, 'finished': time.time()})
+        except Exception as error:
+            traceback.print_exc()
+            with self.lock:
+                self.jobs[job].update({'status': 'failed', 'error': str(error), 'finished': time.time()})
+
+    def Job(self, job: str):
+        with self.lock:
+            return dict(self.jobs[job]) if job in self.jobs else None
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Translates the HTTP requests into calls on the Service of the server
+    """
+    def Reply(self, status: int, body):
+        data = json.dumps(Finite(body), default=str, allow_nan=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def Body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError("the body must be a JSON object")
+        return body
+
+    def Handle(self, route):
+        """
+        Replies with what route() returns, or with a JSON error: 400 for
+        a bad request body, 500 for anything else that goes wrong
+        """
+        try:
+            self.Reply(*route())
+        except (KeyError, ValueError, TypeError) as error:
+            self.Reply(400, {'error': f"Bad request: {error}"})
+        except Exception as error:
+            traceback.print_exc()
+            self.Reply(500, {'error': f"Internal error: {error}"})
+
+    def RouteGet(self):
+        service = self.server.service
+        parts = self.path.strip('/').split('/')
+        if parts == ['portfolios']:
+            with service.lock:
+                return 200, sorted(service.portfolios)
+        if len(parts) == 2 and parts[0] == 'portfolios':
+            value = service.Value(parts[1])
+            return (200, value) if value is not None else (404, {'error': f"Unknown portfolio {parts[1]}"})
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = service.Job(parts[1])
+            return (200, job) if job is not None else (404, {'error': f"Unknown job {parts[1]}"})
+        return 404, {'error': f"Unknown path {self.path}"}
+
+    def RoutePost(self):
+        service = self.server.service
+        parts = self.path.strip('/').split('/')
+        body = self.Body()
+        if len(parts) == 3 and parts[0] == 'portfolios' and parts[2] == 'assets':
+            return 200, service.AddAsset(parts[1], body['ticker'], body.get('sector'), body.get('class'),
+                                         int(body['quantity']), float(body['price']))
+        if len(parts) == 3 and parts[0] == 'portfolios' and parts[2] == 'simulations':
+            job = service.Submit(parts[1], int(body.get('simulations', 1000)), int(body.get('years', 15)),
+                                 body.get('engine', 'parametric'), body.get('seed'))
+            return (202, {'job': job}) if job is not None else (404, {'error': f"Unknown portfolio {parts[1]}"})
+        return 404, {'error': f"Unknown path {self.path}"}
+
+    def do_GET(self):
+        self.Handle(self.RouteGet)
+
+    def do_POST(self):
+        self.Handle(self.RoutePost)
+
+    def log_message(self, format, *args):
+        pass # No line per request on the terminal
+
+
+def Serve(service: Service, port: int = 8765):
+    """
+    Creates the HTTP server of service on localhost (only reachable
+    from this machine). Call serve_forever() on the result
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.service = service
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local portfolio service")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--offline', action='store_true', help="only use locally cached price history")
+    parser.add_argument('--synthetic', action='store_true', help="serve a synthetic market instead of Yahoo Finance")
+    parser.add_argument('--workers', type=int, default=2, help="simulations that run at the same time")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        import os
+        import tempfile
+        from synthetic import SyntheticMarket
+
+        market = SyntheticMarket()
+        directory = tempfile.mkdtemp()
+        service = Service(HistoryCache(os.path.join(directory, 'history.sqlite'), fetch=market.History),
+                          PriceSnapshot(fetch=market.Quotes), ModelRegistry(os.path.join(directory, 'models')), args.workers)
+    else:
+        service = Service(HistoryCache(offline=args.offline), workers=args.workers)
+    server = Serve(service, args.port)
+    print(f"Serving on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
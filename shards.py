@@ -0,0 +1,125 @@
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from features import FeatureState, DAILY_CHANGE, CLOSE
+from forest import FlatForest
+from profiler import Profiler
+
+SHARED = dict() # Models and starting windows of a worker process, loaded once per process
+
+
+def Predict(model, X, profiler=None):
+    """
+    Predicts the rows of the feature matrix X (np.array) with a
+    random forest or a FlatForest. A random forest gets X as a
+    DataFrame with the feature names it was fitted on
+    """
+    if not isinstance(model, FlatForest) and hasattr(model, 'feature_names_in_'):
+        import pandas as pd
+        X = pd.DataFrame(X, columns=model.feature_names_in_)
+    profiler = profiler if profiler is not None else Profiler()
+    with profiler.Phase('predict'):
+        prediction = model.predict(X)
+    profiler.Count('predict_calls')
+    profiler.Count('rows_predicted', len(X))
+    return prediction
+
+
+def SimulatePaths(models, opens, closes, quantities, look_back: int, size: int, num_timesteps: int, rng=np.random, predict=None, profiler=None):
+    """
+    Simulates `size` paths of the portfolio value with the random
+    forests. models, opens, closes (the price history) and quantities
+    are lists with one entry per asset, in the same order.
+    rng is np.random (the global random state) or a np.random.Generator,
+    predict(model, X) defaults to Predict, timed and counted on profiler.
+    Returns an array of shape (size, num_timesteps + 1), the first
+    column is the current value
+    """
+    profiler = profiler if profiler is not None else Profiler()
+    if predict is None:
+        predict = lambda model, X: Predict(model, X, profiler)
+    portfolio_futures = np.zeros((size, num_timesteps + 1))
+    portfolio_futures[:, 0] = sum(quantity * close_prices[-1] for quantity, close_prices in zip(quantities, closes))
+    with profiler.Phase('features'):
+        states = [FeatureState(open_prices, close_prices, look_back, size) for open_prices, close_prices in zip(opens, closes)]
+
+    for t in range(1, num_timesteps + 1):
+        for model, state, quantity in zip(models, states, quantities):
+            latest = state.Latest()
+            predicted_change = predict(model, state.Inputs())
+            randomness = rng.normal(0, np.minimum(np.abs(latest[:, DAILY_CHANGE] * 2), 11))
+
+            predicted_change += randomness
+            new_price = latest[:, CLOSE] + predicted_change
+            new_price[new_price <= 0] = 0.000001 #Non-zero prices.
+            portfolio_futures[:, t] += quantity * new_price
+            with profiler.Phase('features'):
+                state.Update(new_price)
+
+    return portfolio_futures
+
+
+def LoadShared(path: str):
+    """
+    Worker initializer: memory-maps the shared models and windows
+    """
+    import joblib
+    SHARED.update(joblib.load(path, mmap_mode='r'))
+
+
+def SimulateShard(look_back: int, size: int, num_timesteps: int, seed, profile: bool = False):
+    """
+    Simulates one shard on a worker process, seed is the
+    np.random.SeedSequence of the shard. Returns the paths and the
+    report of the shard's profiler (enabled when profile is set)
+    """
+    profiler = Profiler(profile)
+    paths = SimulatePaths(SHARED['models'], SHARED['opens'], SHARED['closes'], SHARED['quantities'],
+                          look_back, size, num_timesteps, np.random.default_rng(seed), profiler=profiler)
+    return paths, profiler.Report()
+
+
+def SimulateShards(models, opens, closes, quantities, look_back: int, num_simulations: int, num_timesteps: int,
+                   shard_size: int = 1000, workers: int = None, seed=None, profiler=None):
+    """
+    Splits the simulations into shards of shard_size paths, each with
+    its own random stream spawned from np.random.SeedSequence(seed),
+    and simulates them on `workers` processes (default: one per core).
+    The models and windows are written to a file once and memory-mapped
+    by every worker instead of being sent with each shard.
+    Yields the shards in order. As the shards and their streams do not
+    depend on the workers, the paths are the same for any number of workers.
+    The timings and counters of the shards are added to profiler (the
+    phases of the workers overlap, so their seconds add up to more than
+    the wall-clock time).
+    """
+    profiler = profiler if profiler is not None else Profiler()
+    sizes = [min(shard_size, num_simulations - first) for first in range(0, num_simulations, shard_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(os.cpu_count() if workers is None else workers, len(sizes))
+    if workers <= 1:
+        for size, shard_seed in zip(sizes, seeds):
+            yield SimulatePaths(models, opens, closes, quantities, look_back, size, num_timesteps,
+                                np.random.default_rng(shard_seed), profiler=profiler)
+        return
+
+    import joblib
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'shared.joblib')
+        joblib.dump({'models': models, 'opens': opens, 'closes': closes, 'quantities': quantities}, path)
+        with ProcessPoolExecutor(max_workers=workers, initializer=LoadShared, initargs=(path,)) as executor:
+            pending = deque() # At most two shards per worker wait to be yielded
+            for size, shard_seed in zip(sizes, seeds):
+                pending.append(executor.submit(SimulateShard, look_back, size, num_timesteps, shard_seed, profiler.enabled))
+                if len(pending) >= 2 * workers:
+                    paths, report = pending.popleft().result()
+                    profiler.Merge(report)
+                    yield paths
+            while len(pending) > 0:
+                paths, report = pending.popleft().result()
+                profiler.Merge(report)
+                yield paths
@@ -0,0 +1,58 @@
+"""
+Checks the startup-time budget of the portfolio tracker: the time
+`python controller.py` takes to show the menu (and exit right away).
+Also checks that none of the heavy libraries are imported before a
+menu action needs them. Exits with code 1 when over budget.
+
+    python startup.py [--runs 5] [--budget 0.5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BUDGET = 0.5 # Seconds from launch until the menu is shown
+HEAVY_MODULES = ['pandas', 'sklearn', 'matplotlib', 'yfinance', 'joblib']
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def MeasureStartup(runs: int = 5):
+    """
+    Starts the application `runs` times, answers the menu with 'E'
+    and returns the wall-clock duration of every run in seconds
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'controller.py'], input='E\n', cwd=DIRECTORY,
+                       capture_output=True, text=True, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def HeavyImports():
+    """
+    Returns the heavy modules that are loaded by importing controller
+    """
+    script = f"import sys, controller; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', script], cwd=DIRECTORY,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Startup-time budget check")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=BUDGET, help="seconds")
+    args = parser.parse_args()
+
+    durations = MeasureStartup(args.runs)
+    median = statistics.median(durations)
+    heavy = HeavyImports()
+    print(f"Startup: median {median:.3f}s, min {min(durations):.3f}s, max {max(durations):.3f}s (budget {args.budget:.3f}s)")
+    if heavy:
+        print(f"Imported at startup: {', '.join(heavy)}")
+    if median > args.budget or heavy:
+        sys.exit(1)
@@ -0,0 +1,86 @@
+import json
+import os
+
+import numpy as np
+
+from aggregate import PathAggregate
+
+
+def MetadataPath(path: str):
+    """
+    The sidecar file with the metadata of the store at path
+    """
+    return os.path.splitext(path)[0] + '.json'
+
+
+class PathStore():
+    """
+    Simulated portfolio paths on disk: a (num_paths x num_timesteps)
+    float32 .npy file that is memory-mapped, so paths can be written
+    batch by batch and read back (sliced) without loading the whole
+    file into memory. The metadata (tickers, quantities, horizon, seed,
+    models, ...) is a JSON file next to it.
+    Opens an existing store, see CreateStore for a new one.
+    """
+    def __init__(self, path: str, mode: str = 'r'):
+        self.path = path
+        self.paths = np.load(path, mmap_mode=mode)
+        with open(MetadataPath(path)) as f:
+            self.metadata = json.load(f)
+        self.num_paths, self.num_timesteps = self.paths.shape
+
+    def __len__(self):
+        return self.num_paths
+
+    def __getitem__(self, index):
+        """
+        Slices the paths like an array, only the selected part is read
+        """
+        return self.paths[index]
+
+    def Write(self, first: int, batch):
+        """
+        Writes a batch of paths from row `first` onwards
+        """
+        self.paths[first:first + len(batch)] = batch
+
+    def Flush(self):
+        """
+        Writes the paths and the metadata to disk
+        """
+        if isinstance(self.paths, np.memmap) and self.paths.mode != 'r':
+            self.paths.flush()
+        with open(MetadataPath(self.path), 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+
+    def Batches(self, batch_size: int = 10000):
+        """
+        Yields the paths batch_size rows at a time (as float64)
+        """
+        for first in range(0, self.num_paths, batch_size):
+            yield np.asarray(self.paths[first:first + batch_size], dtype=float)
+
+    def Aggregate(self, percentiles=(5, 50, 95), batch_size: int = 10000):
+        """
+        Per-timestep statistics of all stored paths, read batch by
+        batch. Returns a PathAggregate
+        """
+        aggregate = PathAggregate(self.num_timesteps, percentiles)
+        for batch in self.Batches(batch_size):
+            aggregate.Add(batch)
+        return aggregate
+
+
+def CreateStore(path: str, num_paths: int, num_timesteps: int, metadata: dict = None):
+    """
+    Preallocates a store for num_paths paths of num_timesteps values
+    and opens it for writing
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    paths = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(num_paths, num_timesteps))
+    paths.flush()
+    del paths
+    with open(MetadataPath(path), 'w') as f:
+        json.dump(dict() if metadata is None else metadata, f, indent=2)
+    return PathStore(path, 'r+')
@@ -0,0 +1,78 @@
+import zlib
+
+import numpy as np
+
+SECTORS = ['Technology', 'Financial Services', 'Healthcare', 'Energy', 'Industrials']
+CLASSES = ['Equity', 'ETF']
+
+
+class SyntheticMarket():
+    """
+    Deterministic stand-in for Yahoo Finance. Every ticker gets its
+    own price history (a geometric random walk seeded by the ticker
+    name), so the same ticker always gives the same data.
+    History and Quotes have the signatures of cache.FetchHistory and
+    prices.FetchQuotes, Info mimics yf.Ticker.info.
+    """
+    def __init__(self, days: int = 252 * 12, seed: int = 0, end=None):
+        import pandas as pd
+        self.days = days
+        self.seed = seed
+        end = pd.Timestamp.today().normalize() if end is None else pd.Timestamp(end)
+        self.dates = pd.bdate_range(end=end, periods=days, tz='America/New_York', name='Date')
+        self.histories = dict()
+
+    def Generator(self, ticker: str):
+        return np.random.default_rng([zlib.crc32(ticker.encode()), self.seed])
+
+    def Full(self, ticker: str):
+        """
+        The complete generated OHLCV history of a ticker
+        """
+        import pandas as pd
+        if ticker not in self.histories:
+            rng = self.Generator(ticker)
+            drift = rng.uniform(-0.0002, 0.0006)
+            volatility = rng.uniform(0.008, 0.03)
+            close = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(drift, volatility, self.days)))
+            open_ = np.empty(self.days)
+            open_[0] = close[0]
+            open_[1:] = close[:-1] * (1 + rng.normal(0, volatility / 4, self.days - 1))
+            spread = np.abs(rng.normal(0, volatility / 2, self.days))
+            self.histories[ticker] = pd.DataFrame({
+                'Open': open_,
+                'High': np.maximum(open_, close) * (1 + spread),
+                'Low': np.minimum(open_, close) * (1 - spread),
+                'Close': close,
+                'Volume': rng.integers(10_000, 10_000_000, self.days).astype(float),
+                'Dividends': 0.0,
+                'Stock Splits': 0.0,
+            }, index=self.dates)
+        return self.histories[ticker]
+
+    def History(self, ticker: str, interval: str = '1d', period: str = None, start: str = None):
+        """
+        Bars of a period or from a start date, like yf.Ticker.history
+        """
+        import pandas as pd
+        from cache import PeriodStart
+        data = self.Full(ticker)
+        if start is None:
+            start = PeriodStart(period if period is not None else '1mo')
+        if start is None:
+            return data.copy()
+        return data[data.index >= pd.Timestamp(start, tz=self.dates.tz)].copy()
+
+    def Quotes(self, tickers):
+        """
+        Latest close of every ticker
+        """
+        return {ticker: float(self.Full(ticker)['Close'].iloc[-1]) for ticker in tickers}
+
+    def Info(self, ticker: str):
+        rng = self.Generator(ticker + ':info')
+        return {
+            'currentPrice': self.Quotes([ticker])[ticker],
+            'sector': SECTORS[rng.integers(len(SECTORS))],
+            'typeDisp': CLASSES[rng.integers(len(CLASSES))],
+        }
@@ -1,25 +1,82 @@
-import matplotlib.pyplot as plt
+import numpy as np
+
+# matplotlib is imported when a plot is made, it is slow to import
+# and most sessions never plot anything
+
+
+def Downsample(values, max_points: int):
+    """
+    Largest-Triangle-Three-Buckets: picks max_points of a long series
+    that keep its visual shape (peaks and dips survive, unlike taking
+    every n-th point). The first and last point are always kept.
+    The points are taken as evenly spaced (like trading days).
+    Returns the positions of the selected points
+    """
+    y = np.asarray(values, dtype=float)
+    if len(y) <= max_points or max_points < 3:
+        return np.arange(len(y))
+    x = np.arange(len(y), dtype=float)
+    edges = np.linspace(1, len(y) - 1, max_points - 1).astype(int) # Buckets between the first and last point
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, len(y) - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following = slice(end, edges[bucket + 2]) if bucket + 2 < len(edges) else slice(len(y) - 1, len(y))
+        next_x, next_y = x[following].mean(), y[following].mean()
+        # Area of the triangle (previous point, candidate, mean of the next bucket)
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
 
 class View():
-    def __init__(self, title: str, xlabel: str, ylabel: str, legend: bool = True):
+    def __init__(self, title: str, xlabel: str, ylabel: str, legend: bool = True, max_points: int = None, path: str = None):
+        """
+        With max_points, series longer than that are downsampled
+        (see Downsample) before they are drawn. With path the plot is
+        rendered to that file by the non-interactive Agg backend
+        instead of shown, e.g. in batch jobs without a display.
+        """
+        import matplotlib
+        if path is not None:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(14, 7))
         plt.xlabel(xlabel)
         plt.ylabel(ylabel)
         plt.title(title)
         self.legend = legend
+        self.max_points = max_points
+        self.path = path
+
+    def Points(self, index, data):
+        """
+        The points of a series that are drawn, all of them unless
+        the series is longer than max_points
+        """
+        if self.max_points is None or len(data) <= self.max_points:
+            return index, data
+        selected = Downsample(data, self.max_points)
+        index = index if hasattr(index, 'take') else np.asarray(index)
+        data = data if hasattr(data, 'take') else np.asarray(data)
+        return index.take(selected), data.take(selected)
 
     def PlotCurrentPrice(self, index, price, label):
         """
         This function adds a horizontal line
         to the plot
         """
+        import matplotlib.pyplot as plt
         plt.axhline(price, linestyle='--', label=f'Current price {label}')
 
     def PlotSingleHistory(self, index, data, label):
-        plt.plot(index, data['Open'], label='Open', alpha=0.7)
-        plt.plot(index, data['Close'], label=f'Close', alpha=0.7)
-        plt.plot(index, data['High'], label=f'High', alpha=0.7)
-        plt.plot(index, data['Low'], label=f'Low', alpha=0.7)
+        import matplotlib.pyplot as plt
+        plt.plot(*self.Points(index, data['Open']), label='Open', alpha=0.7)
+        plt.plot(*self.Points(index, data['Close']), label=f'Close', alpha=0.7)
+        plt.plot(*self.Points(index, data['High']), label=f'High', alpha=0.7)
+        plt.plot(*self.Points(index, data['Low']), label=f'Low', alpha=0.7)
         plt.title(f'Historical OHLC Prices for {label}')
 
     def PlotData(self, index, data, label):
@@ -27,14 +84,70 @@ class View():
         This function plots the historical open / close / high / low
         values of each asset
         """
-        plt.plot(index, data, label=f'{label}', alpha=0.7)
+        import matplotlib.pyplot as plt
+        plt.plot(*self.Points(index, data), label=f'{label}', alpha=0.7)
+
+    def PlotFan(self, index, lower, upper, label):
+        """
+        This function shades the band between two series,
+        e.g. two percentiles of simulated paths
+        """
+        import matplotlib.pyplot as plt
+        plt.fill_between(index, lower, upper, alpha=0.3, label=f'{label}')
+
+    def PlotDensity(self, index, paths, value_bins: int = 200, time_bins: int = 500, batch_size: int = 1000, log: bool = True):
+        """
+        Draws any number of simulated paths (num_paths x len(index),
+        an array or a PathStore) as one image: a time x value 2-D
+        histogram of how many paths pass through every cell. The paths
+        are binned batch_size rows at a time, with logarithmic value
+        bins when log is set.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import LogNorm
+
+        num_paths, num_timesteps = len(paths), len(index)
+        lowest, highest = np.inf, -np.inf
+        for first in range(0, num_paths, batch_size):
+            batch = np.asarray(paths[first:first + batch_size], dtype=float)
+            lowest, highest = min(lowest, batch.min()), max(highest, batch.max())
+        if log:
+            lowest, highest = np.log(max(lowest, 1e-6)), np.log(max(highest, 1e-6))
+        highest = max(highest, lowest + 1e-9)
+
+        columns = np.arange(num_timesteps) * time_bins // num_timesteps # Time bin of every timestep
+        time_bins = columns[-1] + 1
+        counts = np.zeros(time_bins * value_bins, dtype=np.int64)
+        for first in range(0, num_paths, batch_size):
+            batch = np.asarray(paths[first:first + batch_size], dtype=float)
+            if log:
+                batch = np.log(np.maximum(batch, 1e-6))
+            rows = ((batch - lowest) / (highest - lowest) * value_bins).astype(np.int64)
+            np.clip(rows, 0, value_bins - 1, out=rows)
+            counts += np.bincount((columns * value_bins + rows).ravel(), minlength=counts.size)
+
+        x = np.asarray(index, dtype=float)
+        starts = np.searchsorted(columns, np.arange(time_bins))
+        x_edges = np.append(x[starts], x[-1])
+        y_edges = np.linspace(lowest, highest, value_bins + 1)
+        if log:
+            y_edges = np.exp(y_edges)
+            plt.yscale('log')
+        counts = counts.reshape(time_bins, value_bins).T
+        plt.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts, 0), norm=LogNorm(), cmap='viridis', shading='flat')
+        plt.colorbar(label='Paths')
 
     def Show(self):
         """
-        Shows the plot!
+        Shows the plot! (or writes it to path)
         """
+        import matplotlib.pyplot as plt
         if self.legend:
             plt.legend(loc='upper left')
         plt.grid(True)
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        if self.path is not None:
+            plt.savefig(self.path, dpi=120)
+            plt.close()
+        else:
+            plt.show()